@@ -0,0 +1,36 @@
+import random
+
+from flightrecorder.firmware import SRecordFile, Vigenere, VIGENERE_ALPHABET, VIGENERE_KEY, decode
+
+
+IMAGE_SIZE = 512 * 1024
+RECORD_SIZE = 32
+
+
+def srecords():
+    r = random.Random(0)
+    yield 'S00F000068656C6C6F202020202000003C'
+    for address in xrange(0, IMAGE_SIZE, RECORD_SIZE):
+        data = ''.join('%02X' % r.randrange(256) for i in xrange(RECORD_SIZE))
+        yield 'S2%02X%06X%s00' % (RECORD_SIZE + 4, 0xf00000 + address, data)
+    yield 'S804F0000007'
+
+
+def encoded():
+    vigenere = Vigenere(VIGENERE_ALPHABET, VIGENERE_KEY)
+    return list(vigenere.encode(line) + '\r\n' for line in srecords())
+
+
+def bench_vigenere_decode():
+    lines = encoded()
+    return len(lines), lambda: list(decode(lines))
+
+
+def bench_srecordfile():
+    lines = list(decode(encoded()))
+    return len(lines), lambda: SRecordFile(lines)
+
+
+def bench_pages():
+    srf = SRecordFile(list(srecords()))
+    return IMAGE_SIZE / 256, lambda: list(srf.pages())
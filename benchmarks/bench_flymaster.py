@@ -0,0 +1,20 @@
+from flightrecorder.emulator import flymaster_packets, synthetic_tracks
+from flightrecorder.flymaster import Flymaster, Packet
+import flightrecorder.nmea
+flightrecorder.nmea  # suppress pyflakes warning
+
+
+FIXES = 100000
+
+
+def bench_igc_helper():
+    fr = Flymaster(None, 'PBRSNP,B1NAV,,1234,1.21k,,'.encode('nmea_sentence'))
+    track = synthetic_tracks(1, FIXES)[0]
+    records = list(Flymaster.record(Packet(id, data)) for id, data in flymaster_packets(track, 1234) if data is not None)
+    return FIXES, lambda: list(fr.igc_helper(records))
+
+
+def bench_record():
+    track = synthetic_tracks(1, FIXES)[0]
+    packets = list(Packet(id, data) for id, data in flymaster_packets(track, 1234) if data is not None)
+    return len(packets), lambda: [Flymaster.record(packet) for packet in packets]
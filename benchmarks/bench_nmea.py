@@ -0,0 +1,19 @@
+import flightrecorder.nmea
+flightrecorder.nmea  # suppress pyflakes warning
+
+
+SENTENCES = 100000
+
+
+def sentences():
+    return list('PBRWPS,%04d.%03d,N,%05d.%03d,E,W%05d,WAYPOINT %05d,%04d' % (i % 9000, i % 1000, i % 18000, i % 1000, i, i, i % 4000) for i in xrange(SENTENCES))
+
+
+def bench_encode():
+    ss = sentences()
+    return len(ss), lambda: [s.encode('nmea_sentence') for s in ss]
+
+
+def bench_decode():
+    ss = list(s.encode('nmea_sentence') for s in sentences())
+    return len(ss), lambda: [s.decode('nmea_sentence') for s in ss]
@@ -0,0 +1,29 @@
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+import random
+
+from flightrecorder.common import parse_openair
+
+
+AIRSPACES = 5000
+POINTS = 20
+
+
+def openair():
+    r = random.Random(0)
+    lines = ['* Synthetic national airspace file']
+    for i in xrange(AIRSPACES):
+        lines.extend(['AC %s' % r.choice('ABCDEGRPQ'), 'AN AIRSPACE %05d' % i, 'AL GND', 'AH FL%03d' % r.randrange(10, 200)])
+        for j in xrange(POINTS):
+            lines.append('DP %02d:%02d:%02d %s %03d:%02d:%02d %s' % (
+                r.randrange(90), r.randrange(60), r.randrange(60), r.choice('NS'),
+                r.randrange(180), r.randrange(60), r.randrange(60), r.choice('EW')))
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def bench_parse_openair():
+    s = openair()
+    return AIRSPACES, lambda: list(parse_openair(StringIO(s)))
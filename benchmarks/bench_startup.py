@@ -0,0 +1,50 @@
+#   bench_startup.py  Command line startup benchmarks
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+RUNS = 10
+
+# Seconds per run.  The command line takes about five times as long as the
+# bare interpreter on a desktop, so this only trips when something heavy
+# is imported eagerly again
+BUDGETS = {'cli': 0.25}
+
+
+def spawn(argv):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            for i in xrange(RUNS):
+                subprocess.check_call([sys.executable] + argv, stdout=devnull, stderr=devnull, env=env)
+    return RUNS, run
+
+
+def bench_interpreter():
+    return spawn(['-c', 'pass'])
+
+
+def bench_cli():
+    # --help exits after every module-level import has run
+    return spawn([os.path.join(ROOT, 'scripts', 'flightrecorder'), '--help'])
@@ -0,0 +1,73 @@
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+import random
+
+from flightrecorder.waypoint import Waypoint
+import flightrecorder.waypoint as waypoint
+
+
+WAYPOINTS = 50000
+
+
+class Output(list):
+
+    def write(self, s):
+        self.append(s.encode('iso-8859-1') if isinstance(s, unicode) else s)
+
+    def getvalue(self):
+        return ''.join(self)
+
+
+def waypoints():
+    r = random.Random(0)
+    return list(Waypoint('WAYPOINT %05d' % i, r.uniform(-80, 80), r.uniform(-180, 180), r.randrange(0, 4000), id='W%05d' % i) for i in xrange(WAYPOINTS))
+
+
+def dumped(format):
+    output = Output()
+    waypoint.dump(waypoints(), output, format)
+    return output.getvalue()
+
+
+def dump_benchmark(format):
+    ws = waypoints()
+    return len(ws), lambda: waypoint.dump(ws, Output(), format)
+
+
+def load_benchmark(format):
+    s = dumped(format)
+    return WAYPOINTS, lambda: waypoint.load(StringIO(s))
+
+
+def bench_dump_compegps():
+    return dump_benchmark('compegps')
+
+
+def bench_dump_formatgeo():
+    return dump_benchmark('formatgeo')
+
+
+def bench_dump_oziexplorer():
+    return dump_benchmark('oziexplorer')
+
+
+def bench_dump_seeyou():
+    return dump_benchmark('seeyou')
+
+
+def bench_load_compegps():
+    return load_benchmark('compegps')
+
+
+def bench_load_formatgeo():
+    return load_benchmark('formatgeo')
+
+
+def bench_load_oziexplorer():
+    return load_benchmark('oziexplorer')
+
+
+def bench_load_seeyou():
+    return load_benchmark('seeyou')
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#   benchmark.py  Run benchmarks and compare results against baselines
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from glob import glob
+import json
+from optparse import OptionParser
+import os.path
+import platform
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+# Timings depend on the machine, so the default baseline is recorded
+# locally with make benchmark-baseline rather than committed
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.local.json')
+
+
+def modules():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, directory)
+    for filename in sorted(glob(os.path.join(directory, 'bench_*.py'))):
+        yield __import__(os.path.splitext(os.path.basename(filename))[0])
+
+
+def benchmarks(pattern=None):
+    # Each bench_*.py module defines bench_* functions that prepare their
+    # input and return the number of items processed and a function to time
+    for module in modules():
+        for name in sorted(dir(module)):
+            if not name.startswith('bench_'):
+                continue
+            full_name = '%s.%s' % (module.__name__[6:], name[6:])
+            if pattern and not re.search(pattern, full_name):
+                continue
+            yield full_name, getattr(module, name)
+
+
+def run(bench, repeat):
+    items, function = bench()
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    best = min(times)
+    return dict(items=items, seconds=best, rate=items / best if best else None)
+
+
+def bm_run(options, args):
+    results = {}
+    for name, bench in benchmarks(args[0] if args else None):
+        result = run(bench, options.repeat)
+        sys.stderr.write('%-32s %10d items %9.3fs %12.0f items/s\n' % (name, result['items'], result['seconds'], result['rate'] or 0))
+        results[name] = result
+    output = dict(python=platform.python_version(), machine=platform.machine(), time=time.time(), results=results)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(output, file, indent=4, separators=(',', ': '), sort_keys=True)
+    return output
+
+
+def compare(baseline, results, threshold):
+    comparisons = []
+    for name in sorted(results['results']):
+        if name not in baseline['results']:
+            continue
+        before, after = baseline['results'][name]['seconds'], results['results'][name]['seconds']
+        change = (after - before) / before if before else 0.0
+        comparisons.append((name, before, after, change, change > threshold))
+    return comparisons
+
+
+def budgets():
+    # Modules may also define BUDGETS, the most seconds that one item of a
+    # benchmark may take on any machine, which is checked with or without
+    # a baseline
+    result = {}
+    for module in modules():
+        for name, seconds in getattr(module, 'BUDGETS', {}).items():
+            result['%s.%s' % (module.__name__[6:], name)] = seconds
+    return result
+
+
+def over_budget(budgets, results):
+    for name in sorted(results['results']):
+        if name not in budgets:
+            continue
+        result = results['results'][name]
+        seconds = result['seconds'] / result['items']
+        if seconds > budgets[name]:
+            yield name, seconds, budgets[name]
+
+
+def bm_compare(options, args):
+    if len(args) not in (1, 2):
+        raise SystemExit('usage: benchmark.py compare RESULTS [BASELINE]')
+    with open(args[0]) as file:
+        results = json.load(file)
+    failed = False
+    for name, seconds, budget in over_budget(budgets(), results):
+        sys.stdout.write('%-32s %9.3fs per item, budget %.3fs  OVER BUDGET\n' % (name, seconds, budget))
+        failed = True
+    if len(args) == 1 and not os.path.exists(BASELINE):
+        sys.stderr.write('%s: no local baseline, run make benchmark-baseline to record one\n' % BASELINE)
+        return 1 if failed else 0
+    with open(args[1] if len(args) > 1 else BASELINE) as file:
+        baseline = json.load(file)
+    for name, before, after, change, regressed in compare(baseline, results, options.threshold):
+        sys.stdout.write('%-32s %9.3fs %9.3fs %+7.1f%%%s\n' % (name, before, after, 100 * change, '  REGRESSION' if regressed else ''))
+        failed = failed or regressed
+    return 1 if failed else 0
+
+
+def main(argv):
+    parser = OptionParser(usage='%prog [run [PATTERN] | compare RESULTS [BASELINE]]')
+    parser.add_option('-o', '--output', metavar='FILENAME', help='write results to FILENAME')
+    parser.add_option('-r', '--repeat', metavar='N', type=int, help='time each benchmark N times and keep the best')
+    parser.add_option('-t', '--threshold', metavar='FRACTION', type=float, help='report slowdowns greater than FRACTION as regressions')
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(threshold=0.1)
+    options, args = parser.parse_args(argv[1:])
+    if not args or args[0] == 'run':
+        bm_run(options, args[1:])
+        return 0
+    elif args[0] == 'compare':
+        return bm_compare(options, args[1:])
+    else:
+        parser.error('unknown command %r' % args[0])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,181 @@
+#   archive.py  Compressed tracklog archives written in the background
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import calendar
+import logging
+import os
+from Queue import Queue
+import re
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from timing import DISK, timer
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMATS = (
+    (re.compile(r'\.zip\Z', re.I), 'zip'),
+    (re.compile(r'\.(?:tar\.gz|tgz)\Z', re.I), 'w:gz'),
+    (re.compile(r'\.(?:tar\.bz2|tbz2?)\Z', re.I), 'w:bz2'),
+    (re.compile(r'\.tar\Z', re.I), 'w'))
+
+CHUNK_SIZE = 65536
+QUEUE_SIZE = 16
+
+BEGIN = 'begin'
+DATA = 'data'
+END = 'end'
+ABORT = 'abort'
+CLOSE = 'close'
+
+
+def archive_format(filename):
+    for regexp, format in FORMATS:
+        if regexp.search(filename):
+            return format
+    return None
+
+
+class ArchiveWriter(object):
+
+    def __init__(self, filename, queue_size=QUEUE_SIZE):
+        self.format = archive_format(filename)
+        if self.format is None:
+            raise ValueError('unknown archive format %r' % filename)
+        if self.format == 'zip':
+            self.archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(filename, self.format)
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        # The queue is bounded so that a slow disk holds back the download
+        # instead of letting memory grow
+        self.queue = Queue(queue_size)
+        self.exc_info = None
+        self.entry = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, type, value=None):
+        if self.exc_info is not None:
+            self.reraise()
+        # Only time spent waiting for the writer adds to the wall time
+        with timer.phase(DISK):
+            self.queue.put((type, value))
+
+    def reraise(self):
+        type, value, traceback = self.exc_info
+        self.exc_info = None
+        raise type, value, traceback
+
+    def add(self, name, date_time, lines, done=None):
+        self.put(BEGIN, (name, date_time, done))
+        try:
+            chunk, size = [], 0
+            for line in lines:
+                chunk.append(line)
+                size += len(line)
+                if size >= CHUNK_SIZE:
+                    self.put(DATA, ''.join(chunk))
+                    chunk, size = [], 0
+            if chunk:
+                self.put(DATA, ''.join(chunk))
+        except:
+            self.queue.put((ABORT, None))
+            raise
+        self.put(END)
+
+    def close(self, reraise=True):
+        with timer.phase(DISK):
+            self.queue.put((CLOSE, None))
+            self.thread.join()
+        if self.exc_info is not None:
+            if reraise:
+                self.reraise()
+            # Do not hide the exception that is already propagating
+            logger.warning('error writing %r: %s' % (self.filename, self.exc_info[1]))
+            self.exc_info = None
+
+    def run(self):
+        discard = False
+        while True:
+            type, value = self.queue.get()
+            if type == CLOSE:
+                break
+            # The rest of a failed entry is still queued behind the error
+            if discard and type != BEGIN:
+                continue
+            discard = False
+            try:
+                getattr(self, 'do_' + type)(value)
+            except:
+                if self.exc_info is None:
+                    self.exc_info = sys.exc_info()
+                self.do_abort(None)
+                discard = True
+        self.do_abort(None)
+        try:
+            self.archive.close()
+        except:
+            if self.exc_info is None:
+                self.exc_info = sys.exc_info()
+
+    def do_begin(self, value):
+        name, date_time, done = value
+        # Entries are spooled to a temporary file because neither zipfile
+        # nor tarfile can write a member whose size is not yet known
+        fd, filename = tempfile.mkstemp(prefix='.flightrecorder', dir=self.directory)
+        self.entry = (name, date_time, done, os.fdopen(fd, 'w+b'), filename)
+
+    def do_data(self, value):
+        self.entry[3].write(value)
+
+    def do_end(self, value):
+        name, date_time, done, file, filename = self.entry
+        try:
+            if self.format == 'zip':
+                file.close()
+                # zipfile takes the date and permissions from the file
+                mtime = time.mktime(date_time + (0, 0, -1))
+                os.utime(filename, (mtime, mtime))
+                os.chmod(filename, 0644)
+                self.archive.write(filename, name)
+            else:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = file.tell()
+                tarinfo.mtime = calendar.timegm(date_time + (0, 0, 0))
+                tarinfo.mode = 0644
+                file.seek(0)
+                self.archive.addfile(tarinfo, file)
+        finally:
+            self.do_abort(None)
+        if done is not None:
+            done(name)
+
+    def do_abort(self, value):
+        if self.entry is not None:
+            name, date_time, done, file, filename = self.entry
+            self.entry = None
+            file.close()
+            os.remove(filename)
@@ -15,7 +15,20 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from errors import NotAvailableError
+import logging
+import termios
+import tty
+
+from errors import DisconnectError, NotAvailableError, ProtocolError, TimeoutError
+from transport import BAUD_RATES
+
+
+logger = logging.getLogger(__name__)
+
+
+RESYNC_ATTEMPTS = 3
+
+NEGOTIATE_SPEEDS = (tty.B230400, tty.B115200)
 
 
 class FlightRecorderBase(object):
@@ -40,6 +53,82 @@ class FlightRecorderBase(object):
     def pilot_name(self):
         raise NotAvailableError
 
+    @property
+    def detection(self):
+        return dict(driver=self.__class__.__name__, model=self.model, serial_number=self.serial_number, speed=BAUD_RATES.get(self.io.speed))
+
+    def confirm(self, detection):
+        raise NotAvailableError
+
+    def forget_identity(self):
+        pass
+
+    def ping(self):
+        raise NotAvailableError
+
+    def negotiate_speed(self, speeds=NEGOTIATE_SPEEDS):
+        # None of the protocols can switch the instrument's UART speed, but
+        # links that do not depend on it (native USB, RFC 2217 bridges)
+        # accept faster rates, so try each one with a round trip and fall
+        # back to the current speed if the response is garbled.  USB serial
+        # adapters are left alone, a garbled probe can wedge the instrument
+        original = self.io.speed
+        if not self.io.speed_negotiable:
+            return original
+        for speed in speeds:
+            if BAUD_RATES[speed] <= BAUD_RATES.get(original, 0):
+                break
+            try:
+                self.io.set_speed(speed)
+                self.buffer.clear()
+                if self.ping():
+                    logger.info('negotiated %d baud on %r' % (BAUD_RATES[speed], self.io.filename))
+                    return speed
+            except NotAvailableError:
+                break
+            except (ProtocolError, TimeoutError, UnicodeError, ValueError, termios.error):
+                pass
+            self.io.set_speed(original)
+            self.buffer.clear()
+            self.io.flush()
+        if self.io.speed != original:
+            self.io.set_speed(original)
+        return original
+
+    def resync(self):
+        detection = self.detection
+        self.io.reconnect()
+        self.buffer.clear()
+        self.io.flush()
+        # Whatever is on the port now has to identify itself again, another
+        # instrument may have been plugged in
+        self.forget_identity()
+        try:
+            if not self.confirm(detection):
+                raise DisconnectError(self.io.filename)
+        except NotAvailableError:
+            pass
+        logger.info('resynchronized with %r' % self.io.filename)
+
+    def resumable(self, igc_lambda):
+        # Downloads interrupted by a disconnect are restarted after
+        # reconnecting, skipping the lines that have already been returned
+        def resume():
+            count, attempts = 0, 0
+            while True:
+                try:
+                    for i, line in enumerate(igc_lambda()):
+                        if i >= count:
+                            count += 1
+                            yield line
+                    return
+                except DisconnectError:
+                    attempts += 1
+                    if attempts > RESYNC_ATTEMPTS:
+                        raise
+                    self.resync()
+        return resume
+
     def ctri(self):
         raise NotAvailableError
 
@@ -61,9 +150,15 @@ class FlightRecorderBase(object):
     def tracks(self):
         raise NotAvailableError
 
+    def atracks(self):
+        raise NotAvailableError
+
     def waypoints(self):
         raise NotAvailableError
 
+    def awaypoints(self):
+        raise NotAvailableError
+
     def waypoint_remove(self, name=None):
         raise NotAvailableError
 
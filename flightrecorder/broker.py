@@ -0,0 +1,394 @@
+#   broker.py  Keep flight recorders open between command invocations
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cPickle as pickle
+import logging
+import os
+import os.path
+import socket
+import threading
+import time
+import types
+
+from common import Track
+import errors
+from errors import Error, NotAvailableError
+from flightrecorder import FlightRecorder, probe_all
+
+
+logger = logging.getLogger(__name__)
+
+
+IDENTITY = 'manufacturer model serial_number software_version pilot_name'.split()
+
+METHODS = 'ctri ctrs ctr_upload get set to_json waypoint_remove waypoint_upload waypoints'.split()
+
+IGC_BATCH_SIZE = 256
+
+PROBE_INTERVAL = 5
+
+
+def device_inode(filename):
+    # A replugged USB adapter gets a new device node, so its tracks and
+    # identity can no longer be trusted
+    try:
+        st = os.stat(filename)
+        return st.st_dev, st.st_ino
+    except OSError:
+        return None
+
+
+class Device(object):
+
+    def __init__(self, fr):
+        self.fr = fr
+        self.lock = threading.Lock()
+        self.inode = device_inode(fr.io.filename)
+        self.identity = dict(filename=fr.io.filename, waypoint_precision=fr.waypoint_precision)
+        for key in IDENTITY:
+            try:
+                self.identity[key] = getattr(fr, key)
+            except NotAvailableError:
+                pass
+
+    def stale(self):
+        return self.inode != device_inode(self.fr.io.filename)
+
+
+class DeviceRegistry(object):
+
+    def __init__(self, model=None, cache=None, negotiate=False):
+        self.model = model
+        self.cache = cache
+        self.negotiate = negotiate
+        self.lock = threading.RLock()
+        # Probing takes seconds, so it is serialised by its own lock and
+        # does not hold up requests for devices that are already open
+        self.probe_lock = threading.Lock()
+        self.devices = {}
+        self.probed = {}
+
+    def cached(self, device):
+        with self.lock:
+            if device is None and self.devices:
+                device = sorted(self.devices)[0]
+            if device in self.devices:
+                if not self.devices[device].stale():
+                    return self.devices[device]
+                self.drop(device)
+        return None
+
+    def add(self, fr):
+        logger.info('opened %s %s on %r' % (fr.manufacturer, fr.model, fr.io.filename))
+        device = Device(fr)
+        with self.lock:
+            self.devices[fr.io.filename] = device
+        return device
+
+    def open(self, device=None, model=None):
+        result = self.cached(device)
+        if result is None:
+            with self.probe_lock:
+                result = self.cached(device)
+                if result is None:
+                    result = self.add(FlightRecorder(device, model or self.model, self.cache, self.negotiate))
+        return result
+
+    def open_all(self, filenames):
+        with self.probe_lock:
+            now = time.time()
+            with self.lock:
+                for filename in list(self.devices):
+                    if self.devices[filename].stale():
+                        self.drop(filename)
+                # Ports with nothing on them are only probed every few seconds
+                closed = list(filename for filename in filenames if filename not in self.devices and now - self.probed.get(filename, 0) >= PROBE_INTERVAL)
+            frs = probe_all(closed, self.model, cache=self.cache, negotiate=self.negotiate)
+            for fr in frs:
+                self.add(fr)
+            found = set(fr.io.filename for fr in frs)
+            for filename in closed:
+                if filename not in found:
+                    self.probed[filename] = now
+        with self.lock:
+            return list(self.devices[filename] for filename in sorted(self.devices))
+
+    def find(self, serial_number):
+        with self.lock:
+            for device in self.devices.values():
+                if str(device.identity.get('serial_number')) == serial_number and not device.stale():
+                    return device
+        return None
+
+    def drop(self, filename, device=None):
+        with self.lock:
+            # Another request may already have replaced a failed device
+            if device is not None and self.devices.get(filename) is not device:
+                return
+            device = self.devices.pop(filename, None)
+        if device is not None:
+            logger.info('closing %r' % filename)
+            device.fr.io.close()
+
+    def close(self):
+        with self.lock:
+            for filename in list(self.devices):
+                self.drop(filename)
+
+
+class Broker(object):
+
+    def __init__(self, path, model=None, cache=None, negotiate=False):
+        self.path = path
+        self.devices = DeviceRegistry(model, cache, negotiate)
+        self.socket = None
+
+    def call(self, device, method, args, kwargs, send):
+        fr = device.fr
+        if method == 'identify':
+            send(('result', device.identity))
+        elif method == 'tracks':
+            send(('result', [dict((key, value) for key, value in track.__dict__.items() if not key.startswith('_')) for track in fr.tracks()]))
+        elif method == 'igc':
+            # Streamed, so that the long-lived broker does not keep every
+            # tracklog that it has downloaded in memory
+            lines = []
+            for line in fr.tracks()[args[0]].igc_stream():
+                lines.append(line)
+                if len(lines) == IGC_BATCH_SIZE:
+                    send(('item', lines))
+                    lines = []
+            send(('item', lines))
+            send(('end', None))
+        elif method in METHODS:
+            result = getattr(fr, method)(*args, **kwargs)
+            send(('result', list(result) if isinstance(result, types.GeneratorType) else result))
+        else:
+            raise NotAvailableError(method)
+
+    def handle(self, connection):
+        file = connection.makefile('rwb')
+
+        def send(response):
+            pickle.dump(response, file, pickle.HIGHEST_PROTOCOL)
+            file.flush()
+        try:
+            while True:
+                try:
+                    filename, model, method, args, kwargs = pickle.load(file)
+                except EOFError:
+                    break
+                try:
+                    device = self.devices.open(filename, model)
+                except Error, e:
+                    send(('error', (e.__class__.__name__, e.msg)))
+                    continue
+                with device.lock:
+                    try:
+                        self.call(device, method, args, kwargs, send)
+                    except NotAvailableError, e:
+                        send(('error', (e.__class__.__name__, e.msg)))
+                    except Error, e:
+                        # Force detection to run again on the next request
+                        self.devices.drop(device.fr.io.filename, device)
+                        send(('error', (e.__class__.__name__, e.msg)))
+                    except (IOError, socket.error):
+                        # The client went away in the middle of a response,
+                        # so the flight recorder may still be sending
+                        self.devices.drop(device.fr.io.filename, device)
+                        raise
+                    except Exception, e:
+                        logger.exception('%s failed' % method)
+                        self.devices.drop(device.fr.io.filename, device)
+                        send(('error', ('Error', str(e))))
+        except (IOError, socket.error):
+            pass
+        finally:
+            try:
+                file.close()
+            except (IOError, socket.error):
+                pass
+            connection.close()
+
+    def listen(self):
+        if os.path.exists(self.path):
+            client = connect(self.path)
+            if client is not None:
+                client.close()
+                raise RuntimeError('broker already running on %r' % self.path)
+            os.unlink(self.path)
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Requests are pickled, so only the owner may connect
+        umask = os.umask(077)
+        try:
+            self.socket.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.socket.listen(5)
+
+    def serve_forever(self):
+        if self.socket is None:
+            self.listen()
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except socket.error:
+                if self.socket is None:
+                    break
+                raise
+            thread = threading.Thread(target=self.handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        if self.socket is not None:
+            s, self.socket = self.socket, None
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            s.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        self.devices.close()
+
+
+class BrokerClient(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+        self.file = None
+
+    def connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.file = self.socket.makefile('rwb')
+
+    def close(self):
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket, self.file = None, None
+
+    def request(self, filename, model, method, args=(), kwargs={}):
+        if self.socket is None:
+            self.connect()
+        pickle.dump((filename, model, method, args, kwargs), self.file, pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+
+    def response(self):
+        type, value = pickle.load(self.file)
+        if type == 'error':
+            name, msg = value
+            raise getattr(errors, name, Error)(msg)
+        return type, value
+
+    def call(self, filename, model, method, *args, **kwargs):
+        self.request(filename, model, method, args, kwargs)
+        return self.response()[1]
+
+    def stream(self, filename, model, method, *args, **kwargs):
+        self.request(filename, model, method, args, kwargs)
+        finished = False
+        try:
+            while True:
+                type, value = self.response()
+                if type == 'end':
+                    finished = True
+                    return
+                for item in value:
+                    yield item
+        finally:
+            # An abandoned stream leaves responses in flight
+            if not finished:
+                self.close()
+
+
+def connect(path):
+    client = BrokerClient(path)
+    try:
+        client.connect()
+    except socket.error:
+        return None
+    return client
+
+
+def identity_property(key):
+    def get(self):
+        if key not in self.identity:
+            raise NotAvailableError
+        return self.identity[key]
+    return property(get)
+
+
+def remote_method(method):
+    def call(self, *args, **kwargs):
+        return self.client.call(self.filename, None, method, *args, **kwargs)
+    return call
+
+
+class RemoteIO(object):
+
+    def __init__(self, client, filename):
+        self.client = client
+        self.filename = filename
+
+    def close(self):
+        self.client.close()
+
+
+class RemoteFlightRecorder(object):
+
+    def __init__(self, client, device=None, model=None):
+        self.client = client
+        self.identity = client.call(device, model, 'identify')
+        self.filename = self.identity['filename']
+        self.waypoint_precision = self.identity['waypoint_precision']
+        self.io = RemoteIO(client, self.filename)
+        self._tracks = None
+
+    manufacturer = identity_property('manufacturer')
+    model = identity_property('model')
+    serial_number = identity_property('serial_number')
+    software_version = identity_property('software_version')
+    pilot_name = identity_property('pilot_name')
+
+    def igc_lambda(self, index):
+        return lambda: self.client.stream(self.filename, None, 'igc', index)
+
+    def tracks(self):
+        if self._tracks is None:
+            self._tracks = []
+            for index, attrs in enumerate(self.client.call(self.filename, None, 'tracks')):
+                self._tracks.append(Track(_igc_lambda=self.igc_lambda(index), **attrs))
+        return self._tracks
+
+    def flash(self, model, srf):
+        raise NotAvailableError
+
+    ctri = remote_method('ctri')
+    ctrs = remote_method('ctrs')
+    ctr_upload = remote_method('ctr_upload')
+    get = remote_method('get')
+    set = remote_method('set')
+    to_json = remote_method('to_json')
+    waypoint_remove = remote_method('waypoint_remove')
+    waypoint_upload = remote_method('waypoint_upload')
+    waypoints = remote_method('waypoints')
@@ -0,0 +1,248 @@
+#   capture.py  Wire capture and replay transports
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import re
+import struct
+import threading
+import time
+import urlparse
+
+from errors import DisconnectError, ProtocolError, TimeoutError
+from transport import Transport
+import wiretrace
+from wiretrace import DISCONNECT, READ, TIMEOUT, WRITE
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = 'FRCAP\x01'
+
+# Each record is a type, a stream number, a timestamp relative to the
+# start of the session, the data length and the data
+RECORD = struct.Struct('<cHdI')
+
+OPEN = 'O'
+
+REPLAY_DEVICE_RE = re.compile(r'\Areplay://([^#?]+)(?:\?([^#]*))?(?:#(.*))?\Z')
+
+
+class CaptureSession(object):
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.streams = 0
+
+    def open(self, filename):
+        with self.lock:
+            stream = self.streams
+            self.streams += 1
+        self.record(OPEN, stream, filename)
+        return stream
+
+    def record(self, type, stream, data=''):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(type, stream, time.time() - self.start, len(data)))
+            self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class CaptureIO(Transport):
+
+    def __init__(self, io, session):
+        self.io = io
+        self.session = session
+        self.stream = session.open(io.filename)
+
+    @property
+    def filename(self):
+        return self.io.filename
+
+    @property
+    def speed(self):
+        return self.io.speed
+
+    @property
+    def speed_negotiable(self):
+        return self.io.speed_negotiable
+
+    @property
+    def metrics(self):
+        return self.io.metrics
+
+    def read(self, timeout=1, n=None):
+        try:
+            data = self.io.read(timeout, n)
+        except TimeoutError:
+            self.session.record(TIMEOUT, self.stream)
+            raise
+        except DisconnectError:
+            self.session.record(DISCONNECT, self.stream)
+            raise
+        self.session.record(READ, self.stream, data)
+        return data
+
+    def write(self, line):
+        self.session.record(WRITE, self.stream, line)
+        self.io.write(line)
+
+    def set_speed(self, speed):
+        self.io.set_speed(speed)
+
+    def reconnect(self):
+        self.io.reconnect()
+
+    def flush(self):
+        self.io.flush()
+
+    def close(self):
+        self.io.close()
+
+    def batching(self, vmin=255, vtime=1):
+        return self.io.batching(vmin, vtime)
+
+    def flow_control(self):
+        return self.io.flow_control()
+
+
+def load(filename):
+    with open(filename, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise IOError('%s: not a capture file' % filename)
+    offset = len(MAGIC)
+    records = []
+    while offset < len(data):
+        type, stream, timestamp, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        records.append((type, stream, timestamp, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplayIO(Transport):
+
+    def __init__(self, filename, device=None, realtime=False):
+        self.filename = 'replay://%s' % filename
+        records = load(filename)
+        if device is None:
+            # Default to the first stream that received a response
+            streams = list(stream for type, stream, timestamp, data in records if type == READ)
+        else:
+            streams = list(stream for type, stream, timestamp, data in records if type == OPEN and data == device)
+        if not streams and device is not None:
+            raise IOError('%s: no capture of %r' % (filename, device))
+        stream = streams[0] if streams else 0
+        self.records = list((type, timestamp, data) for type, s, timestamp, data in records if s == stream and type != OPEN)
+        self.index = 0
+        self.pending = ''
+        self.realtime = realtime
+        self.start = None
+
+    def wait(self, timestamp):
+        if not self.realtime:
+            return
+        if self.start is None:
+            self.start = time.time() - timestamp
+        delay = self.start + timestamp - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def disconnected(self):
+        wiretrace.ring.record(DISCONNECT, self.filename)
+        raise DisconnectError(self.filename)
+
+    def next(self, expected):
+        if self.index == len(self.records):
+            self.disconnected()
+        type, timestamp, data = self.records[self.index]
+        if type not in expected:
+            raise ProtocolError('replay diverged at record %d: expected %s, got %s %r' % (self.index, '/'.join(expected), type, data))
+        self.index += 1
+        self.wait(timestamp)
+        return type, data
+
+    def read(self, timeout=1, n=None):
+        if not self.pending:
+            type, data = self.next((READ, TIMEOUT, DISCONNECT))
+            if type == TIMEOUT:
+                self.metrics.timeout()
+                wiretrace.ring.record(TIMEOUT, self.filename)
+                raise TimeoutError
+            elif type == DISCONNECT:
+                self.disconnected()
+            self.pending = data
+        n = n or len(self.pending)
+        data, self.pending = self.pending[:n], self.pending[n:]
+        self.metrics.read(data)
+        wiretrace.ring.record(READ, self.filename, data)
+        return data
+
+    def write(self, line):
+        self.metrics.write(line)
+        wiretrace.ring.record(WRITE, self.filename, line)
+        type, data = self.next((WRITE,))
+        if data != line:
+            raise ProtocolError('replay diverged at record %d: expected %r, got %r' % (self.index - 1, data, line))
+
+    def set_speed(self, speed):
+        self.speed = speed
+
+    def reconnect(self):
+        self.pending = ''
+
+
+session = None
+
+
+def start(filename):
+    global session
+    logger.info('capturing to %r' % filename)
+    session = CaptureSession(filename)
+
+
+def stop():
+    global session
+    if session is not None:
+        session.close()
+        session = None
+
+
+def wrap(io):
+    if session is None:
+        return io
+    return CaptureIO(io, session)
+
+
+def open_replay(device):
+    # replay://FILENAME[?realtime][#DEVICE]
+    m = REPLAY_DEVICE_RE.match(device)
+    if m is None:
+        return None
+    query = urlparse.parse_qs(m.group(2) or '', keep_blank_values=True)
+    return ReplayIO(m.group(1), m.group(3), 'realtime' in query)
@@ -15,7 +15,64 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import errno
+import logging
+import os
+import os.path
 import re
+import tempfile
+import time
+
+from timing import DECODE, timer
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_json(filename, default=None):
+    try:
+        with open(filename) as file:
+            # Imported here so that startup without state files is faster
+            import json
+            return json.load(file)
+    except IOError:
+        return default
+    except ValueError:
+        # Starting afresh would overwrite the damaged file on the next
+        # save, so keep it aside
+        corrupt = '%s.corrupt-%d' % (filename, time.time())
+        logger.warning('%r is corrupt, moved to %r' % (filename, corrupt))
+        try:
+            os.rename(filename, corrupt)
+        except OSError:
+            pass
+        return default
+
+
+def atomic_write(filename, data):
+    # Concurrent writers each write their own temporary file in the same
+    # directory and rename it into place, so that readers never see a
+    # partial file
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(data)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, filename)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def atomic_write_json(filename, value):
+    import json
+    atomic_write(filename, json.dumps(value, indent=4, separators=(',', ': '), sort_keys=True))
 
 
 def simplerepr(obj):
@@ -76,14 +133,26 @@ class Track(object):
     @property
     def igc(self):
         if self._igc is None:
-            self._igc = []
-            for line in self._igc_lambda():
+            # Only cache complete tracklogs, not abandoned downloads
+            lines = []
+            for line in self.igc_stream():
                 yield line
-                self._igc.append(line)
+                lines.append(line)
+            self._igc = lines
         else:
             for line in self._igc:
                 yield line
 
+    def igc_stream(self):
+        # Like igc, but without keeping the lines, so that memory use does
+        # not grow with the length of the tracklog
+        if self._igc is not None:
+            return iter(self._igc)
+        return timer.iterate(DECODE, self._igc_lambda())
+
+    def aigc(self, callback=None):
+        return self._aigc_lambda(callback)
+
     def to_json(self, igc=False):
         json = {}
         for key, value in self.__dict__.items():
@@ -121,7 +190,9 @@ def parse_openair(io):
             continue
         if l.startswith('AC '):
             ctr = CTR(None, None, None, [])
-            ac = l[3:].strip()
+            ac, al = l[3:].strip(), ''
+        elif ctr is None and l[:3] in ('AN ', 'AL ', 'AH ', 'DP '):
+            raise ValueError('%r before AC' % l)
         elif l.startswith('AN '):
             ctr.name = l[3:].strip()
         elif l.startswith('AL '):
@@ -131,7 +202,8 @@ def parse_openair(io):
             ctr.remark = '%s %s-%s' % (ac, al, ah)
         elif l.startswith('DP '):
             m = re.match(r'\ADP\s+(\d+):(\d+):(\d+)\s+([NS])\s+(\d+):(\d+):(\d+)\s+([EW])\Z', l)
-            assert m is not None
+            if m is None:
+                raise ValueError('invalid point %r' % l)
             lat = int(m.group(1)) + int(m.group(2)) / 60.0 + int(m.group(3)) / 3600.0
             if m.group(4) == 'S':
                 lat = -lat
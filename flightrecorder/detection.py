@@ -0,0 +1,54 @@
+#   detection.py  Persistent flight recorder detection cache
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+
+from common import atomic_write_json, load_json
+
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionCache(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = load_json(self.filename, {})
+
+    def get(self, identity):
+        with self.lock:
+            return self.entries.get(identity)
+
+    def set(self, identity, entry):
+        with self.lock:
+            if self.entries.get(identity) == entry:
+                return
+            self.entries[identity] = entry
+            self.save()
+
+    def discard(self, identity):
+        with self.lock:
+            if self.entries.pop(identity, None) is not None:
+                self.save()
+
+    def save(self):
+        try:
+            atomic_write_json(self.filename, self.entries)
+        except (IOError, OSError):
+            logger.warning('cannot save detection cache to %r' % self.filename)
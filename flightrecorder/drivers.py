@@ -0,0 +1,41 @@
+#   drivers.py  Registry of lazily imported flight recorder drivers
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Driver modules are only imported once a flight recorder that needs them
+# has been found, so listing models costs nothing at startup
+DRIVERS = (
+    ('Fifty20', 'fifty20', '5020 5030 6020 6030 COMPEO COMPEO+ COMPETINO COMPETINO+ GALILEO'.split()),
+    ('Flymaster', 'flymaster', 'B1NAV'.split()),
+    ('Sixty15', 'sixty15', '6015 IQ-BASIC'.split()))
+
+MODELS = dict((name, models) for name, module, models in DRIVERS)
+
+SUPPORTED_MODELS = list(model for name, module, models in DRIVERS for model in models)
+
+
+def driver_class(name):
+    for driver_name, module, models in DRIVERS:
+        if driver_name == name:
+            return getattr(__import__(module, globals()), name)
+    return None
+
+
+def model_driver_class(model):
+    for name, module, models in DRIVERS:
+        if model in models:
+            return driver_class(name)
+    return None
@@ -0,0 +1,381 @@
+#   emulator.py  Flight recorder emulators on pseudo-terminals
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import datetime
+import logging
+import os
+import random
+import re
+import select
+import struct
+import threading
+import time
+import tty
+
+from fifty20 import XOFF, XON
+from flymaster import EPOCH
+from framing import FrameBuffer
+import nmea
+nmea  # suppress pyflakes warning
+from sixty15 import FA_FORMAT, FA_Owner, PA_DeviceNr, PA_FORMAT, PA_SoftVers
+
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 64
+
+ACK = '\xb1'
+NAK = '\xb2'
+
+
+class Fix(object):
+
+    def __init__(self, dt, lat, lon, alt, pressure):
+        self.dt = dt
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.pressure = pressure
+
+
+class SyntheticTrack(object):
+
+    def __init__(self, index, dt, fixes):
+        self.index = index
+        self.datetime = dt
+        self.duration = fixes[-1].dt - fixes[0].dt if fixes else datetime.timedelta(0)
+        self.fixes = fixes
+
+    def igc(self, manufacturer, serial_number):
+        yield 'A%s%d\r\n' % (manufacturer, serial_number)
+        yield 'HFDTE%s\r\n' % self.datetime.strftime('%d%m%y')
+        for fix in self.fixes:
+            yield 'B%s%02d%05d%s%03d%05d%sA%05d%05d\r\n' % (
+                fix.dt.strftime('%H%M%S'),
+                abs(fix.lat) / 60000, abs(fix.lat) % 60000, 'S' if fix.lat < 0 else 'N',
+                abs(fix.lon) / 60000, abs(fix.lon) % 60000, 'W' if fix.lon < 0 else 'E',
+                fix.alt, fix.alt)
+        yield 'G%016X\r\n' % self.index
+
+
+class SyntheticWaypoint(object):
+
+    def __init__(self, name, lat, lon, alt):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+
+
+def synthetic_tracks(count, fixes, seed=0):
+    # Positions are in thousandths of a minute, as used by Flymaster
+    # instruments, and change slowly enough to be sent as deltas
+    r = random.Random(seed)
+    tracks = []
+    dt = datetime.datetime(2011, 6, 1, 10, 0, 0)
+    for index in xrange(count):
+        lat, lon, alt = r.randrange(-80 * 60000, 80 * 60000), r.randrange(-180 * 60000, 180 * 60000), r.randrange(0, 4000)
+        track_fixes = []
+        for i in xrange(fixes):
+            pressure = int(10132 * pow(1.0 - alt / 44307.69, 1.0 / 0.190284))
+            track_fixes.append(Fix(dt + datetime.timedelta(seconds=i), lat, lon, alt, pressure))
+            lat += r.randint(-100, 100)
+            lon += r.randint(-100, 100)
+            alt = max(0, alt + r.randint(-5, 5))
+        tracks.append(SyntheticTrack(index, dt, track_fixes))
+        dt -= datetime.timedelta(days=1)
+    return tracks
+
+
+def synthetic_waypoints(count, seed=0):
+    r = random.Random(seed)
+    return list(SyntheticWaypoint('W%05d' % i, r.uniform(-80, 80), r.uniform(-180, 180), r.randrange(0, 4000)) for i in xrange(count))
+
+
+def flymaster_packets(track, serial_number):
+    yield 0xa0a0, struct.pack('<BBBBI8s15s15s15s', 1, 21, 1, 0, serial_number, 'EMU', 'Emulated Pilot', 'Emulated', 'Glider') + '\0\0'
+    previous, deltas = None, []
+    for fix in track.fixes:
+        if previous is not None:
+            delta = (0x80, fix.lat - previous.lat, fix.lon - previous.lon, fix.alt - previous.alt, fix.pressure - previous.pressure, (fix.dt - previous.dt).seconds)
+            if all(-128 <= d < 128 for d in delta[1:]) and len(deltas) < 42:
+                deltas.append(struct.pack('<Bbbbbb', *delta))
+                previous = fix
+                continue
+        if deltas:
+            yield 0xa2a2, ''.join(deltas)
+            deltas = []
+        yield 0xa1a1, struct.pack('<BiihhI', 0x80, fix.lat, fix.lon, fix.alt, fix.pressure, (fix.dt - EPOCH).days * 86400 + (fix.dt - EPOCH).seconds)
+        previous = fix
+    if deltas:
+        yield 0xa2a2, ''.join(deltas)
+    yield 0xa3a3, None
+
+
+class Emulator(object):
+
+    def __init__(self, tracks=10, fixes=600, waypoints=10, serial_number=1234, baud_rate=None, latency=0, jitter=0, faults=0, seed=0):
+        self.tracks = synthetic_tracks(tracks, fixes, seed)
+        self.waypoints = synthetic_waypoints(waypoints, seed)
+        self.serial_number = serial_number
+        self.baud_rate = baud_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.faults = faults
+        self.random = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.filename = os.ttyname(self.slave)
+        self.buffer = FrameBuffer()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        # Tests close the emulator early to unplug the device
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = self.slave = None
+
+    def readframe(self):
+        return self.buffer.readline('\n')
+
+    def nextframe(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.running:
+            frame = self.readframe()
+            if frame is not None:
+                return frame
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.time())
+            if wait < 0:
+                return None
+            if select.select([self.master], [], [], wait)[0]:
+                self.buffer.feed(os.read(self.master, 1024))
+        return None
+
+    def run(self):
+        while self.running:
+            frame = self.nextframe()
+            if frame is None:
+                continue
+            try:
+                self.handle(frame)
+            except Exception:
+                logger.exception('%s failed to handle %r' % (self.__class__.__name__, frame))
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def send(self, data):
+        if self.faults and self.random.random() < self.faults:
+            i = self.random.randrange(len(data))
+            data = data[:i] + chr(ord(data[i]) ^ 0x55) + data[i + 1:]
+        for i in xrange(0, len(data), CHUNK_SIZE):
+            chunk = data[i:i + CHUNK_SIZE]
+            if self.baud_rate:
+                time.sleep(10.0 * len(chunk) / self.baud_rate)
+            os.write(self.master, chunk)
+
+    def handle(self, frame):
+        raise NotImplementedError
+
+
+class Fifty20Emulator(Emulator):
+
+    model = 'COMPEO+'
+    pilot_name = 'Emulated Pilot'
+    software_version = '1.22'
+
+    def __init__(self, **kwargs):
+        Emulator.__init__(self, **kwargs)
+        self.memory = bytearray(256)
+        self.memory[0:16] = self.pilot_name.ljust(16)
+
+    def respond(self, sentences, raw=False):
+        self.delay()
+        self.send(XOFF + ''.join(s if raw else s.encode('nmea_sentence') for s in sentences) + XON)
+
+    def handle(self, frame):
+        try:
+            command = frame.decode('nmea_sentence')
+        except UnicodeError:
+            return
+        if command == 'PBRSNP,':
+            self.respond(['PBRSNP,%s,%s,%d,%s' % (self.model, self.pilot_name, self.serial_number, self.software_version)])
+        elif command == 'PBRTL,':
+            self.respond(list('PBRTL,%02d,%02d,%s,%s,%02d:%02d:%02d' % (
+                len(self.tracks),
+                track.index,
+                track.datetime.strftime('%d.%m.%y'),
+                track.datetime.strftime('%H:%M:%S'),
+                track.duration.seconds / 3600, (track.duration.seconds / 60) % 60, track.duration.seconds % 60) for track in self.tracks))
+        elif command.startswith('PBRTR,'):
+            track = self.tracks[int(command[6:])]
+            self.respond(track.igc('XFL', self.serial_number), raw=True)
+        elif command == 'PBRWPS,':
+            self.respond(list('PBRWPS,%02d%06.3f,%s,%03d%06.3f,%s,%s,%s,%04d' % (
+                abs(60 * w.lat) / 60, abs(60 * w.lat) % 60, 'S' if w.lat < 0 else 'N',
+                abs(60 * w.lon) / 60, abs(60 * w.lon) % 60, 'W' if w.lon < 0 else 'E',
+                w.name[:6], w.name.ljust(17), w.alt) for w in self.waypoints))
+        elif command.startswith('PBRMEMR,'):
+            address = int(command[8:], 16)
+            self.respond(['PBRMEMR,%04X,%s' % (address, ','.join('%02X' % b for b in self.memory[address:address + 8]))])
+        elif command.startswith('PBRCTRW,'):
+            # The last point of an airspace is acknowledged
+            n, i = command.split(',')[1:3]
+            self.respond(['PBRANS,1'] if int(i) == int(n) - 1 else [])
+        elif command == 'PBRCTR,':
+            self.respond([
+                'PBRCTR,003,000,%s,%04d' % ('EMULATED CTR'.ljust(17), 500),
+                'PBRCTR,003,001,%s' % 'REMARK'.ljust(17),
+                'PBRCTR,003,002,C,4600.000,N,00600.000,E,1000'])
+        else:
+            self.respond([])
+
+
+class FlymasterEmulator(Emulator):
+
+    model = 'B1NAV'
+    software_version = '1.21k'
+
+    def readframe(self):
+        if self.buffer.peek(1) in (ACK, NAK):
+            return self.buffer.read(1)
+        return Emulator.readframe(self)
+
+    def respond(self, sentences):
+        self.delay()
+        for sentence in sentences:
+            self.send(sentence.encode('nmea_sentence'))
+
+    def packet(self, id, data=None):
+        if data is None:
+            packet = struct.pack('<H', id)
+        else:
+            checksum = len(data)
+            for c in data:
+                checksum ^= ord(c)
+            packet = struct.pack('<HB', id, len(data)) + data + chr(checksum)
+        while True:
+            self.send(packet)
+            if data is None or self.nextframe(1) != NAK:
+                break
+
+    def pfmdnl(self, track):
+        self.delay()
+        for id, data in flymaster_packets(track, self.serial_number):
+            self.packet(id, data)
+
+    def handle(self, frame):
+        if frame in (ACK, NAK):
+            return
+        try:
+            command = frame.decode('nmea_sentence')
+        except UnicodeError:
+            return
+        snp = '%s,,%d,%s,,' % (self.model, self.serial_number, self.software_version)
+        if command == 'PBRSNP,':
+            self.respond(['PBRSNP,' + snp])
+        elif command == 'PFMSNP,':
+            self.respond(['PFMSNP,' + snp])
+        elif command == 'PFMDNL,LST,':
+            self.respond(list('PFMLST,%03d,%03d,%s,%s,%02d:%02d:%02d' % (
+                len(self.tracks),
+                track.index,
+                track.datetime.strftime('%d.%m.%y'),
+                track.datetime.strftime('%H:%M:%S'),
+                track.duration.seconds / 3600, (track.duration.seconds / 60) % 60, track.duration.seconds % 60) for track in self.tracks))
+        elif command.startswith('PFMDNL,'):
+            m = re.match(r'PFMDNL,(\d{12}),\Z', command)
+            for track in self.tracks:
+                if m and track.datetime.strftime('%y%m%d%H%M%S') == m.group(1):
+                    self.pfmdnl(track)
+                    break
+            else:
+                self.packet(0xa3a3)
+        elif command == 'PFMWPL,':
+            self.respond(list('PFMWPL,%08.4f,%s,%08.4f,%s,%d,%s,0' % (
+                abs(w.lat), 'S' if w.lat < 0 else 'N',
+                abs(w.lon), 'W' if w.lon < 0 else 'E',
+                w.alt, w.name.ljust(16)) for w in self.waypoints))
+
+
+class Sixty15Emulator(Emulator):
+
+    bd = 'Flytec 6015'
+    pilot_name = 'Emulated Pilot'
+    software_version = 1234
+
+    def readframe(self):
+        return self.buffer.readline('\r\n')
+
+    def respond(self, lines):
+        self.delay()
+        self.send(''.join(lines))
+
+    def rxa(self, x, parameter, format, value):
+        if value is None:
+            self.respond(['No Par\r\n'])
+        else:
+            self.respond(['R%cA_%02X_%s\r\n' % (x, parameter, ''.join('%02X' % ord(c) for c in struct.pack(format, value)))])
+
+    def handle(self, frame):
+        command = frame.rstrip()
+        if command == 'ACT_BD_00':
+            self.respond([self.bd + '\r\n'])
+        elif command == 'ACT_20_00':
+            if not self.tracks:
+                self.respond([' No Data\r\n'])
+                return
+            self.respond(list('%2d; %s; %s;  0; %02d:%02d:%02d;  0; 1000;  500;  5.0; -5.0;  50.0;%s;%s;%s\r\n' % (
+                track.index,
+                track.datetime.strftime('%y.%m.%d'),
+                track.datetime.strftime('%H:%M:%S'),
+                track.duration.seconds / 3600, (track.duration.seconds / 60) % 60, track.duration.seconds % 60,
+                self.pilot_name.ljust(16), 'Glider'.ljust(16), 'ID'.ljust(16)) for track in self.tracks) + [' Done\r\n'])
+        elif command.startswith('ACT_21_'):
+            self.respond(self.tracks[int(command[7:], 16)].igc('XFL', self.serial_number))
+        elif command == 'ACT_31_00':
+            if not self.waypoints:
+                self.respond(['No Data\r\n'])
+                return
+            self.respond(list('%s;%s %2d\'%06.3f;%s %3d\'%06.3f;%6d;%6d\r\n' % (
+                w.name.ljust(16),
+                'S' if w.lat < 0 else 'N', abs(60 * w.lat) / 60, abs(60 * w.lat) % 60,
+                'W' if w.lon < 0 else 'E', abs(60 * w.lon) / 60, abs(60 * w.lon) % 60,
+                w.alt, 400) for w in self.waypoints) + [' Done\r\n'])
+        elif command.startswith('RPA_'):
+            parameter = int(command[4:], 16)
+            values = {PA_DeviceNr: self.serial_number, PA_SoftVers: self.software_version}
+            self.rxa('P', parameter, PA_FORMAT.get(parameter), values.get(parameter))
+        elif command.startswith('RFA_'):
+            parameter = int(command[4:], 16)
+            values = {FA_Owner: self.pilot_name.ljust(16)}
+            self.rxa('F', parameter, FA_FORMAT.get(parameter), values.get(parameter))
@@ -34,6 +34,14 @@ class TimeoutError(Error):
     pass
 
 
+class NotFoundError(TimeoutError):
+    pass
+
+
+class DisconnectError(Error):
+    pass
+
+
 class ReadError(Error):
     pass
 
@@ -22,9 +22,12 @@ import struct
 
 from base import FlightRecorderBase
 from common import CTR, CTRPoint, Track, add_igc_filenames, simplerepr
+from drivers import MODELS
 from errors import NotAvailableError, ProtocolError
+from framing import FrameBuffer
 import nmea
 nmea  # suppress pyflakes warning
+from reactor import Return
 from utc import UTC
 from waypoint import Waypoint
 
@@ -108,60 +111,91 @@ class SNP(object):
 
 class Fifty20(FlightRecorderBase):
 
-    SUPPORTED_MODELS = '5020 5030 6020 6030 COMPEO COMPEO+ COMPETINO COMPETINO+ GALILEO'.split()
+    SUPPORTED_MODELS = MODELS['Fifty20']
 
     def __init__(self, io, line=None):
         self.io = io
-        self.buffer = ''
+        self.buffer = FrameBuffer()
         self._snp = SNP(*PBRSNP_RE.match(line[1:-1].decode('nmea_sentence')).groups()) if line else None
         self._tracks = None
         self._waypoints = None
         self.waypoint_precision = 1
 
+    def readframe(self):
+        marker = self.buffer.readmarker(XON + XOFF)
+        if marker is not None:
+            return marker
+        line = self.buffer.readline()
+        if line is not None:
+            self.io.metrics.lines()
+        return line
+
+    def readresponse(self):
+        lines, ended = self.buffer.readlines('\n', XON)
+        self.io.metrics.lines(len(lines))
+        return lines, ended
+
     def readline(self, timeout=1):
-        if self.buffer == '':
-            self.buffer = self.io.read(timeout)
-        if self.buffer[0] == XON:
-            self.buffer = self.buffer[1:]
-            logger.debug('read XON')
-            return XON
-        elif self.buffer[0] == XOFF:
-            self.buffer = self.buffer[1:]
-            logger.debug('read XOFF')
-            return XOFF
-        else:
-            line = ''
-            while True:
-                index = self.buffer.find('\n')
-                if index == -1:
-                    line += self.buffer
-                    self.buffer = self.io.read(timeout)
-                else:
-                    line += self.buffer[:index + 1]
-                    self.buffer = self.buffer[index + 1:]
-                    logger.info('readline %r' % line)
-                    return line
+        while True:
+            line = self.readframe()
+            if line is not None:
+                return line
+            self.buffer.feed(self.io.read(timeout))
+
+    def areadline(self, timeout=1):
+        while True:
+            line = self.readframe()
+            if line is not None:
+                raise Return(line)
+            self.buffer.feed((yield self.io.aread(timeout)))
 
     def write(self, line):
-        logger.info('write %r' % line)
         self.io.write(line)
 
+    def aieach(self, command, re=None, timeout=1, callback=None):
+        result = []
+        try:
+            self.write(command.encode('nmea_sentence'))
+            if (yield self.areadline(timeout)) != XOFF:
+                raise ProtocolError
+            while True:
+                lines, ended = self.readresponse()
+                for line in lines:
+                    if re is not None:
+                        m = re.match(line.decode('nmea_sentence'))
+                        if m is None:
+                            raise ProtocolError(line)
+                        line = m
+                    if callback is None:
+                        result.append(line)
+                    else:
+                        callback(line)
+                if ended:
+                    break
+                self.buffer.feed((yield self.io.aread(timeout)))
+        except:
+            self.io.flush()
+            raise
+        raise Return(result)
+
     def ieach(self, command, re=None, timeout=1):
         try:
             self.write(command.encode('nmea_sentence'))
             if self.readline(timeout) != XOFF:
                 raise ProtocolError
             while True:
-                line = self.readline(timeout)
-                if line == XON:
+                lines, ended = self.readresponse()
+                for line in lines:
+                    if re is None:
+                        yield line
+                    else:
+                        m = re.match(line.decode('nmea_sentence'))
+                        if m is None:
+                            raise ProtocolError(line)
+                        yield m
+                if ended:
                     break
-                elif re is None:
-                    yield line
-                else:
-                    m = re.match(line.decode('nmea_sentence'))
-                    if m is None:
-                        raise ProtocolError(line)
-                    yield m
+                self.buffer.feed(self.io.read(timeout))
         except:
             self.io.flush()
             raise
@@ -321,28 +355,40 @@ class Fifty20(FlightRecorderBase):
     def pbrsnp(self):
         return SNP(*self.one('PBRSNP,', PBRSNP_RE, 0.2).groups())
 
-    def pbrtl(self):
-        tracks = []
+    def apbrsnp(self):
+        ms = yield self.aieach('PBRSNP,', PBRSNP_RE, 0.2)
+        if len(ms) != 1:
+            raise ProtocolError
+        raise Return(SNP(*ms[0].groups()))
+
+    def pbrtl_track(self, m):
+        index = int(m.group(2))
+        day, month, year, hour, minute, second = (int(i) for i in m.groups()[2:8])
+        hours, minutes, seconds = (int(i) for i in m.groups()[8:11])
+        return Track(
+            count=int(m.group(1)),
+            index=index,
+            datetime=datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC()),
+            duration=datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds),
+            _igc_lambda=self.resumable(lambda: self.ipbrtr(index)),
+            _aigc_lambda=lambda callback: self.aipbrtr(index, callback))
 
-        def igc_lambda(self, index):
-            return lambda: self.ipbrtr(index)
-        for m in self.ieach('PBRTL,', PBRTL_RE, 0.5):
-            index = int(m.group(2))
-            day, month, year, hour, minute, second = (int(i) for i in m.groups()[2:8])
-            hours, minutes, seconds = (int(i) for i in m.groups()[8:11])
-            tracks.append(Track(
-                count=int(m.group(1)),
-                index=index,
-                datetime=datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC()),
-                duration=datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds),
-                _igc_lambda=igc_lambda(self, index)))
+    def pbrtl(self):
+        tracks = list(self.pbrtl_track(m) for m in self.ieach('PBRTL,', PBRTL_RE, 0.5))
         return add_igc_filenames(tracks, self.manufacturer[:3].upper(), self.serial_number)
 
+    def apbrtl(self):
+        ms = yield self.aieach('PBRTL,', PBRTL_RE, 0.5)
+        if self._snp is None:
+            self._snp = yield self.apbrsnp()
+        tracks = list(self.pbrtl_track(m) for m in ms)
+        raise Return(add_igc_filenames(tracks, self.manufacturer[:3].upper(), self.serial_number))
+
     def pbrtle(self):
         tracks = []
 
         def igc_lambda(self, index):
-            return lambda: self.ipbrtr(index)
+            return self.resumable(lambda: self.ipbrtr(index))
         for m in self.ieach('PBRTLE,', PBRTLE_RE, 0.5):
             index = int(m.group(2))
             day, month, year, hour, minute, second = (int(i) for i in m.groups()[2:8])
@@ -360,7 +406,12 @@ class Fifty20(FlightRecorderBase):
         return add_igc_filenames(tracks, self.manufacturer, self.serial_number)
 
     def ipbrtr(self, index):
-        return self.ieach('PBRTR,%02d' % index)
+        with self.io.batching(), self.io.flow_control():
+            for line in self.ieach('PBRTR,%02d' % index):
+                yield line
+
+    def aipbrtr(self, index, callback=None):
+        return self.aieach('PBRTR,%02d' % index, None, 1, callback)
 
     def pbrtr(self, index):
         return list(self.ipbrtr(index))
@@ -378,18 +429,26 @@ class Fifty20(FlightRecorderBase):
             waypoint.alt or 0))
         return name
 
+    @staticmethod
+    def pbrwps_waypoint(m):
+        lat = int(m.group(1)) + float(m.group(2)) / 60
+        if m.group(3) == 'S':
+            lat *= -1
+        lon = int(m.group(4)) + float(m.group(5)) / 60
+        if m.group(6) == 'W':
+            lon *= -1
+        id = m.group(7)
+        name = m.group(8)
+        alt = int(m.group(9))
+        return Waypoint(name, lat, lon, alt, id=id)
+
     def ipbrwps(self):
         for m in self.ieach('PBRWPS,', PBRWPS_RE):
-            lat = int(m.group(1)) + float(m.group(2)) / 60
-            if m.group(3) == 'S':
-                lat *= -1
-            lon = int(m.group(4)) + float(m.group(5)) / 60
-            if m.group(6) == 'W':
-                lon *= -1
-            id = m.group(7)
-            name = m.group(8)
-            alt = int(m.group(9))
-            yield Waypoint(name, lat, lon, alt, id=id)
+            yield self.pbrwps_waypoint(m)
+
+    def apbrwps(self):
+        ms = yield self.aieach('PBRWPS,', PBRWPS_RE)
+        raise Return(list(self.pbrwps_waypoint(m) for m in ms))
 
     def pbrwps(self):
         return list(self.ipbrwps())
@@ -433,6 +492,16 @@ class Fifty20(FlightRecorderBase):
             self._snp = self.pbrsnp()
         return self._snp
 
+    def confirm(self, detection):
+        self._snp = self.pbrsnp()
+        return self.detection == detection
+
+    def forget_identity(self):
+        self._snp = None
+
+    def ping(self):
+        return self.pbrsnp().serial_number == self.serial_number
+
     def ctri(self):
         return self.pbrctri()
 
@@ -466,9 +535,17 @@ class Fifty20(FlightRecorderBase):
             self._tracks = self.pbrtl()
         return self._tracks
 
+    def atracks(self):
+        if self._tracks is None:
+            self._tracks = yield self.apbrtl()
+        raise Return(self._tracks)
+
     def waypoints(self):
         return self.ipbrwps()
 
+    def awaypoints(self):
+        return self.apbrwps()
+
     def waypoint_remove(self, name=None):
         if name is None:
             for name in [w.name for w in self.ipbrwps()]:
@@ -19,12 +19,16 @@ from glob import glob
 import logging
 import re
 import os
+from Queue import Queue
+import threading
 
-from errors import TimeoutError
-from fifty20 import Fifty20
-from flymaster import Flymaster
-from serialio import SerialIO
-from sixty15 import Sixty15
+import capture
+from drivers import SUPPORTED_MODELS, driver_class, model_driver_class
+from errors import NotAvailableError, NotFoundError, ProtocolError, TimeoutError
+from reactor import Return
+from serialio import AsyncSerialIO, SerialIO
+from transport import DEFAULT_SPEED, SPEEDS
+from usb import usb_identity
 
 
 logger = logging.getLogger(__name__)
@@ -39,55 +43,243 @@ DEVICE_GLOBS = {
     'Linux': (
         '/dev/ttyUSB*',)}
 
+TCP_SCHEMES = ('tcp://', 'rfc2217://')
+
+# Precomputed so that identification does not need the NMEA codec
+PBRSNP = '$PBRSNP,*21\r\n'
+
+
+def device_globs():
+    return DEVICE_GLOBS.get(os.uname()[0], ())
+
+
+def device_filenames():
+    return list(filename for device_glob in device_globs() for filename in sorted(glob(device_glob)))
+
+
+def open_device(device):
+    io = capture.open_replay(device)
+    if io is None and device.startswith(TCP_SCHEMES):
+        # Only TCP bridges need the socket module
+        from tcpio import open_tcp
+        io = open_tcp(device)
+    return capture.wrap(io or SerialIO(device))
+
+
+def device_identity(device):
+    # TCP serial bridges are identified by their URL, replayed captures
+    # are never cached because they must follow the captured exchange
+    if device.startswith('replay://'):
+        return None
+    if device.startswith(TCP_SCHEMES):
+        return device
+    return usb_identity(device)
+
+
+def pbrsnp_complete(line):
+    return line.find('\x11' if line[:1] == '\x13' else '\n') != -1
+
+
+def actbd_complete(line):
+    return line.find('\n') != -1
+
+
+# Each probe is a command, a test for a complete response, and the drivers
+# whose responses it matches.  The next probe is only tried if there is no
+# response at all.
+PROBES = (
+    (PBRSNP, pbrsnp_complete, (
+        (re.compile('\x13\$PBRSNP,[^,]*,[^,]*,[^,]*,[^,]*\*[0-9A-F]{2}\r\n\x11\Z'), 'Fifty20'),
+        (re.compile('\$PBRSNP,[^,]*,[^,]*,[^,]*,[^,]*,[^,]*,[^,]*\*[0-9A-F]{2}\r\n\Z'), 'Flymaster'))),
+    ('ACT_BD_00\r\n', actbd_complete, (
+        (re.compile('(Flytec 6015|IQ-Basic GPS)\r\n\Z'), 'Sixty15'),)))
+
+
+def identified(io, line, responses):
+    for regexp, name in responses:
+        if regexp.match(line):
+            return driver_class(name)(io, line)
+    return None
+
+
+def identify(io, model=None):
+    driver = model_driver_class(model)
+    if driver is not None:
+        return driver(io)
+    for command, complete, responses in PROBES:
+        io.write(command)
+        try:
+            line = io.read(0.2)
+            while not complete(line):
+                line += io.read()
+        except TimeoutError:
+            continue
+        return identified(io, line, responses)
+    return None
+
+
+def aidentify(io, model=None):
+    if model is not None:
+        raise Return(identify(io, model))
+    for command, complete, responses in PROBES:
+        io.write(command)
+        try:
+            line = yield io.aread(0.2)
+            while not complete(line):
+                line += yield io.aread()
+        except TimeoutError:
+            continue
+        raise Return(identified(io, line, responses))
+    raise Return(None)
+
+
+def restore(io, detection):
+    driver = driver_class(detection.get('driver'))
+    if driver is None:
+        return None
+    fr = driver(io)
+    try:
+        speed = SPEEDS.get(detection.get('speed'), DEFAULT_SPEED)
+        if speed == io.speed:
+            if fr.confirm(detection):
+                return fr
+        else:
+            io.set_speed(speed)
+            if fr.confirm(detection) and fr.ping():
+                return fr
+    except (NotAvailableError, ProtocolError, TimeoutError, UnicodeError):
+        pass
+    if io.speed != DEFAULT_SPEED:
+        io.set_speed(DEFAULT_SPEED)
+    io.flush()
+    return None
+
+
+def probe(device, model=None, cache=None, negotiate=False):
+    try:
+        io = open_device(device)
+    except (IOError, OSError):
+        return None
+    fr = None
+    try:
+        identity = device_identity(device) if cache is not None and model is None else None
+        if identity is not None:
+            detection = cache.get(identity)
+            if detection is not None:
+                fr = restore(io, detection)
+                if fr is not None:
+                    logger.info('restored %s on %r' % (detection['driver'], device))
+        if fr is None:
+            fr = identify(io, model)
+            if fr is not None and negotiate:
+                fr.negotiate_speed()
+            if fr is not None and identity is not None:
+                cache.set(identity, fr.detection)
+    finally:
+        if fr is None:
+            io.close()
+    return fr
+
+
+def probe_all(devices, model=None, first=False, cache=None, negotiate=False):
+    results = Queue()
+
+    def prober(device):
+        fr = None
+        try:
+            fr = probe(device, model, cache, negotiate)
+        finally:
+            results.put((device, fr))
+
+    def closer(count):
+        for i in xrange(count):
+            device, fr = results.get()
+            if fr is not None:
+                fr.io.close()
+
+    for device in devices:
+        thread = threading.Thread(target=prober, args=(device,))
+        thread.daemon = True
+        thread.start()
+    frs = {}
+    for i in xrange(len(devices)):
+        device, fr = results.get()
+        if fr is None:
+            continue
+        frs[device] = fr
+        if first:
+            thread = threading.Thread(target=closer, args=(len(devices) - i - 1,))
+            thread.daemon = True
+            thread.start()
+            break
+    return list(frs[device] for device in devices if device in frs)
+
+
+def aprobe(reactor, device, model=None):
+    try:
+        io = AsyncSerialIO(reactor, device)
+    except (IOError, OSError):
+        raise Return(None)
+    fr = None
+    try:
+        fr = yield aidentify(io, model)
+    finally:
+        if fr is None:
+            io.close()
+    raise Return(fr)
+
+
+def aprobe_all(reactor, devices, model=None):
+    frs = []
+
+    def prober(device):
+        try:
+            fr = yield aprobe(reactor, device, model)
+        except Exception:
+            logger.exception('probing %r failed' % device)
+            raise Return(None)
+        if fr is not None:
+            frs.append(fr)
+        raise Return(fr)
+
+    complete = False
+    try:
+        results = yield reactor.gather(*(prober(device) for device in devices))
+        complete = True
+    finally:
+        if not complete:
+            for fr in frs:
+                fr.io.close()
+    raise Return(list(fr for fr in results if fr is not None))
+
 
 class FlightRecorder(object):
 
-    SUPPORTED_MODELS = Fifty20.SUPPORTED_MODELS + Flymaster.SUPPORTED_MODELS + Sixty15.SUPPORTED_MODELS
+    SUPPORTED_MODELS = SUPPORTED_MODELS
 
-    def __new__(self, device=None, model=None):
-        if device:
-            devices = (device,)
+    def __new__(self, device=None, model=None, cache=None, negotiate=False):
+        devices = (device,) if device else device_filenames()
+        if model is not None and model not in FlightRecorder.SUPPORTED_MODELS:
+            raise RuntimeError  # FIXME
+        if model is not None:
+            for device in devices:
+                fr = probe(device, model, negotiate=negotiate)
+                if fr is not None:
+                    return fr
         else:
-            device_globs = DEVICE_GLOBS.get(os.uname()[0], ())
-            devices = list(filename for device_glob in device_globs for filename in sorted(glob(device_glob)))
+            for fr in probe_all(devices, model, first=True, cache=cache, negotiate=negotiate):
+                return fr
+        raise NotFoundError
+
+    @staticmethod
+    def all(model=None, cache=None, negotiate=False):
+        if model is not None and model not in FlightRecorder.SUPPORTED_MODELS:
+            raise RuntimeError  # FIXME
+        return probe_all(device_filenames(), model, cache=cache, negotiate=negotiate)
+
+    @staticmethod
+    def aall(reactor, model=None):
         if model is not None and model not in FlightRecorder.SUPPORTED_MODELS:
             raise RuntimeError  # FIXME
-        for device in devices:
-            try:
-                io = SerialIO(device)
-            except IOError:
-                continue
-            if model in Fifty20.SUPPORTED_MODELS:
-                return Fifty20(io)
-            elif model in Flymaster.SUPPORTED_MODELS:
-                return Flymaster(io)
-            elif model in Sixty15.SUPPORTED_MODELS:
-                return Sixty15(io)
-            elif model is None:
-                try:
-                    try:
-                        line = 'PBRSNP,'.encode('nmea_sentence')
-                        logger.info('write %r' % line)
-                        io.write(line)
-                        line = io.read(0.2)
-                        while line.find('\x11' if line[0] == '\x13' else '\n') == -1:
-                            line += io.read()
-                        logger.info('readline %r' % line)
-                        if re.match('\x13\$PBRSNP,[^,]*,[^,]*,[^,]*,[^,]*\*[0-9A-F]{2}\r\n\x11\Z', line):
-                            return Fifty20(io, line)
-                        if re.match('\$PBRSNP,[^,]*,[^,]*,[^,]*,[^,]*,[^,]*,[^,]*\*[0-9A-F]{2}\r\n\Z', line):
-                            return Flymaster(io, line)
-                    except TimeoutError:
-                        line = 'ACT_BD_00\r\n'
-                        logger.info('write %r' % line)
-                        io.write(line)
-                        line = io.read(0.2)
-                        while line.find('\n') == -1:
-                            line += io.read()
-                        logger.info('readline %r' % line)
-                        if re.match('(Flytec 6015|IQ-Basic GPS)\r\n\Z', line):
-                            logger.info('read %r' % line)
-                            return Sixty15(io, line)
-                except TimeoutError:
-                    pass
-        raise TimeoutError
+        frs = yield aprobe_all(reactor, device_filenames(), model)
+        raise Return(frs)
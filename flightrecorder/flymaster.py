@@ -22,9 +22,13 @@ import struct
 
 from base import FlightRecorderBase
 from common import Track, add_igc_filenames
+from drivers import MODELS
 from errors import NotAvailableError, ProtocolError, TimeoutError
+from framing import FrameBuffer
+from idle import IdleListing, idle_timeout
 import nmea
 nmea  # suppress pyflakes warning
+from reactor import Return
 from utc import UTC
 from waypoint import Waypoint
 
@@ -109,60 +113,140 @@ class TrackPositionRecordDeltas(list):
             i += 6
 
 
+class TrackDecoder(object):
+
+    # Turns records into IGC lines one at a time, so that the asynchronous
+    # download can pass lines on as the packets arrive
+
+    def __init__(self, model, serial_number):
+        self.model = model
+        self.serial_number = serial_number
+        self.date, self.lat, self.lon, self.alt, self.pressure, self.dt = None, None, None, None, None, None
+
+    def header(self):
+        return 'AFLYMASTER %s %s\r\n' % (self.model, self.serial_number)
+
+    def b_record(self, fix_flag):
+        lat, lon = self.lat, self.lon
+        return 'B%s%02d%02d%03d%c%03d%02d%03d%c%c%05d%05d\r\n' % (
+            self.dt.strftime('%H%M%S'),
+            abs(lat) / 60000, (abs(lat) % 60000) / 1000, abs(lat) % 1000, 'S' if lat < 0 else 'N',
+            abs(lon) / 60000, (abs(lon) % 60000) / 1000, abs(lon) % 1000, 'E' if lon < 0 else 'W',
+            'A' if fix_flag & 0x80 else 'V',
+            Flymaster.pressure_altitude(self.pressure),
+            self.alt)
+
+    def decode(self, record):
+        if isinstance(record, FlightInformationRecord):
+            yield 'HFPLTPILOT:%s\r\n' % record.pilot_name
+            yield 'HPGTYGLIDERTYPE:%s %s\r\n' % (record.glider_brand, record.glider_model)
+            yield 'HPCIDCOMPETITIONID:%s\r\n' % record.competition_id
+            yield 'HFRFWFIRMWAREVERSION:%s\r\n' % record.software_version
+            yield 'HFRHWHARDWAREVERSION:%s\r\n' % record.hardware_version
+            yield 'HFFTYFRTYPE:FLYMASTER,%s\r\n' % self.model
+        elif isinstance(record, KeyTrackPositionRecord):
+            if record.dt.date() != self.date:
+                yield 'HFDTE%s\r\n' % record.dt.strftime('%d%m%y')
+                self.date = record.dt.date()
+            self.lat, self.lon, self.alt, self.pressure, self.dt = record.lat, record.lon, record.alt, record.pressure, record.dt
+            yield self.b_record(record.fix_flag)
+        elif isinstance(record, TrackPositionRecordDeltas):
+            if self.lat is None:
+                logger.debug('Track position record delta received before key track position record')
+                return
+            for tprd in record:
+                self.lat += tprd.lat_offset
+                self.lon += tprd.lon_offset
+                self.alt += tprd.alt_offset
+                self.pressure += tprd.pressure_offset
+                self.dt += tprd.dt_offset
+                if self.dt.date() != self.date:
+                    yield 'HFDTE%s\r\n' % self.dt.strftime('%d%m%y')
+                    self.date = self.dt.date()
+                yield self.b_record(tprd.fix_flag)
+
+
 class Flymaster(FlightRecorderBase):
 
-    SUPPORTED_MODELS = 'B1NAV'.split()
+    SUPPORTED_MODELS = MODELS['Flymaster']
 
     def __init__(self, io, line=None):
         self.io = io
         self._snp = SNP(*PBRSNP_RE.match(line.decode('nmea_sentence')).groups()) if line else None
         self._pfmdnl_lst = None
-        self.buffer = ''
+        self.buffer = FrameBuffer()
         self.waypoint_precision = 15
 
+    def readframe(self):
+        line = self.buffer.readline()
+        if line is not None:
+            self.io.metrics.lines()
+        return line
+
     def readline(self, timeout):
-        result = ''
         while True:
-            index = self.buffer.find('\n')
-            if index == -1:
-                result += self.buffer
-                self.buffer = self.io.read(timeout)
-            else:
-                result += self.buffer[0:index + 1]
-                self.buffer = self.buffer[index + 1:]
-                logger.info('readline %r' % result)
-                return result
+            line = self.readframe()
+            if line is not None:
+                return line
+            self.buffer.feed(self.io.read(timeout))
+
+    def areadline(self, timeout):
+        while True:
+            line = self.readframe()
+            if line is not None:
+                raise Return(line)
+            self.buffer.feed((yield self.io.aread(timeout)))
+
+    def areadmatch(self, re, timeout=1):
+        line = yield self.areadline(timeout)
+        m = re.match(line.decode('nmea_sentence'))
+        if m is None:
+            raise ProtocolError(line)
+        raise Return(m)
+
+    def readpacketframe(self):
+        header = self.buffer.peek(2)
+        if header is None:
+            return None
+        id = struct.unpack('<H', header)[0]
+        if id == 0xa3a3:
+            self.buffer.consume(2)
+            self.io.metrics.packet()
+            return Packet(id, None)
+        s = self.buffer.readpacket(2, 1)
+        if s is None:
+            return None
+        length = ord(s[2])
+        data = s[3:length + 3]
+        checksum = length
+        for c in data:
+            checksum ^= ord(c)
+        if checksum != ord(s[length + 3]):
+            self.io.metrics.checksum_error()
+            self.io.metrics.nak()
+            self.write('\xb2')
+            return False
+        self.io.metrics.packet()
+        self.write('\xb1')
+        return Packet(id, data)
 
     def readpacket(self, timeout):
         while True:
-            s = None
-            while True:
-                if len(self.buffer) >= 2:
-                    id = struct.unpack('<H', self.buffer[:2])[0]
-                    if id == 0xa3a3:
-                        logger.info('readpacket %r' % self.buffer[:2])
-                        self.buffer = self.buffer[2:]
-                        return Packet(id, None)
-                    if len(self.buffer) >= 4:
-                        length = ord(self.buffer[2])
-                        if len(self.buffer) >= 4 + length:
-                            s = self.buffer[:4 + length]
-                            self.buffer = self.buffer[4 + length:]
-                            break
-                self.buffer += self.io.read(timeout)
-            logger.info('readpacket %r' % s[:length + 4])
-            data = s[3:length + 3]
-            checksum = length
-            for c in data:
-                checksum ^= ord(c)
-            if checksum != ord(s[length + 3]):
-                self.write('\xb2')
-                continue
-            self.write('\xb1')
-            return Packet(id, data)
+            packet = self.readpacketframe()
+            if packet:
+                return packet
+            elif packet is None:
+                self.buffer.feed(self.io.read(timeout))
+
+    def areadpacket(self, timeout):
+        while True:
+            packet = self.readpacketframe()
+            if packet:
+                raise Return(packet)
+            elif packet is None:
+                self.buffer.feed((yield self.io.aread(timeout)))
 
     def write(self, line):
-        logger.info('write %r' % line)
         self.io.write(line)
 
     def ieach(self, command, re=None, timeout=1):
@@ -177,6 +261,51 @@ class Flymaster(FlightRecorderBase):
                     raise ProtocolError(line)
                 yield m
 
+    def idle_listing(self, command, timeout=1):
+        listing = IdleListing(idle_timeout(self.model, self.software_version, command), timeout)
+        self.write(command.encode('nmea_sentence'))
+        return listing
+
+    def end_idle_listing(self, listing):
+        listing.finished()
+        # Anything still arriving would be taken as the response to the
+        # next command
+        if len(self.buffer):
+            logger.warning('discarding %r after listing' % self.buffer.getvalue())
+        self.buffer.clear()
+        self.io.flush()
+
+    @staticmethod
+    def match(line, re):
+        if re is None:
+            return line
+        m = re.match(line.decode('nmea_sentence'))
+        if m is None:
+            raise ProtocolError(line)
+        return m
+
+    def ieach_until_idle(self, command, re=None, timeout=1):
+        listing = self.idle_listing(command, timeout)
+        try:
+            while True:
+                line = self.readline(listing.timeout())
+                listing.received()
+                yield self.match(line, re)
+        except TimeoutError:
+            self.end_idle_listing(listing)
+
+    def aeach_until_idle(self, command, re=None, timeout=1):
+        listing = self.idle_listing(command, timeout)
+        result = []
+        try:
+            while True:
+                line = yield self.areadline(listing.timeout())
+                listing.received()
+                result.append(self.match(line, re))
+        except TimeoutError:
+            self.end_idle_listing(listing)
+        raise Return(result)
+
     def none(self, command):
         self.write(command.encode('nmea_sentence'))
 
@@ -188,11 +317,8 @@ class Flymaster(FlightRecorderBase):
         self.none('PFMIDS,%s,%s,%s' % tuple(x[:w].ljust(w) if x else '' for x, w in ((civl_id, 7), (competition_id, 7), (pilot_name, 15))))
 
     def ipfmcfg(self):
-        try:
-            for m in self.ieach('PFMCFG,', PFMCFG_RE):
-                yield m.groups()
-        except TimeoutError:
-            pass  # FIXME
+        for m in self.ieach_until_idle('PFMCFG,', PFMCFG_RE):
+            yield m.groups()
 
     def pfmcfg(self):
         return dict(self.ipfmcfg())
@@ -200,98 +326,114 @@ class Flymaster(FlightRecorderBase):
     def pfmsnp(self):
         return SNP(*self.one('PFMSNP,', PFMSNP_RE).groups())
 
-    def igc_helper(self, packets):
-        yield 'AFLYMASTER %s %s\r\n' % (self.model, self.serial_number)
-        date, lat, lon, alt, pressure, dt = None, None, None, None, None, None
-        for packet in packets:
-            if isinstance(packet, FlightInformationRecord):
-                yield 'HFPLTPILOT:%s\r\n' % packet.pilot_name
-                yield 'HPGTYGLIDERTYPE:%s %s\r\n' % (packet.glider_brand, packet.glider_model)
-                yield 'HPCIDCOMPETITIONID:%s\r\n' % packet.competition_id
-                yield 'HFRFWFIRMWAREVERSION:%s\r\n' % packet.software_version
-                yield 'HFRHWHARDWAREVERSION:%s\r\n' % packet.hardware_version
-                yield 'HFFTYFRTYPE:FLYMASTER,%s\r\n' % self.model
-            elif isinstance(packet, KeyTrackPositionRecord):
-                if packet.dt.date() != date:
-                    yield 'HFDTE%s\r\n' % packet.dt.strftime('%d%m%y')
-                    date = packet.dt.date()
-                lat, lon, alt, pressure, dt = packet.lat, packet.lon, packet.alt, packet.pressure, packet.dt
-                yield 'B%s%02d%02d%03d%c%03d%02d%03d%c%c%05d%05d\r\n' % (
-                    dt.strftime('%H%M%S'),
-                    abs(lat) / 60000, (abs(lat) % 60000) / 1000, abs(lat) % 1000, 'S' if lat < 0 else 'N',
-                    abs(lon) / 60000, (abs(lon) % 60000) / 1000, abs(lon) % 1000, 'E' if lon < 0 else 'W',
-                    'A' if packet.fix_flag & 0x80 else 'V',
-                    Flymaster.pressure_altitude(pressure),
-                    alt)
-            elif isinstance(packet, TrackPositionRecordDeltas):
-                if lat is None:
-                    logger.debug('Track position record delta received before key track position record' % packet)
-                    continue
-                for tprd in packet:
-                    lat += tprd.lat_offset
-                    lon += tprd.lon_offset
-                    alt += tprd.alt_offset
-                    pressure += tprd.pressure_offset
-                    dt += tprd.dt_offset
-                    if dt.date() != date:
-                        yield 'HFDTE%s\r\n' % dt.strftime('%d%m%y')
-                        date = dt.date()
-                    yield 'B%s%02d%02d%03d%c%03d%02d%03d%c%c%05d%05d\r\n' % (
-                        dt.strftime('%H%M%S'),
-                        abs(lat) / 60000, (abs(lat) % 60000) / 1000, abs(lat) % 1000, 'S' if lat < 0 else 'N',
-                        abs(lon) / 60000, (abs(lon) % 60000) / 1000, abs(lon) % 1000, 'E' if lon < 0 else 'W',
-                        'A' if tprd.fix_flag & 0x80 else 'V',
-                        Flymaster.pressure_altitude(pressure),
-                        alt)
+    def apfmsnp(self):
+        self.write('PFMSNP,'.encode('nmea_sentence'))
+        m = yield self.areadmatch(PFMSNP_RE)
+        raise Return(SNP(*m.groups()))
+
+    def igc_helper(self, records):
+        decoder = TrackDecoder(self.model, self.serial_number)
+        yield decoder.header()
+        for record in records:
+            for line in decoder.decode(record):
+                yield line
+
+    def pfmdnl_lst_track(self, m):
+        index, day, month, year, hour, minute, second = map(int, m.groups()[1:8])
+        hours, minutes, seconds = map(int, m.groups()[8:11])
+        dt = datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC())
+        return Track(
+            index=index,
+            datetime=dt,
+            duration=datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds),
+            _igc_lambda=self.resumable(lambda: self.igc_helper(self.ipfmdnl(dt))),
+            _aigc_lambda=lambda callback: self.aipfmdnl(dt, callback))
 
     def pfmdnl_lst(self):
         tracks = []
-
-        def igc_lambda(self, dt):
-            return lambda: self.igc_helper(self.ipfmdnl(dt))
         for m in self.ieach('PFMDNL,LST,', PFMDNL_LST_RE):
-            count, index, day, month, year, hour, minute, second = map(int, m.groups()[:8])
-            hours, minutes, seconds = map(int, m.groups()[8:11])
-            dt = datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC())
-            tracks.append(Track(
-                index=index,
-                datetime=dt,
-                duration=datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds),
-                _igc_lambda=igc_lambda(self, dt)))
-            if index + 1 == count:
+            tracks.append(self.pfmdnl_lst_track(m))
+            if int(m.group(2)) + 1 == int(m.group(1)):
                 break
         return add_igc_filenames(tracks, 'XFR', self.serial_number)
 
+    def apfmdnl_lst(self):
+        tracks = []
+        self.write('PFMDNL,LST,'.encode('nmea_sentence'))
+        while True:
+            m = yield self.areadmatch(PFMDNL_LST_RE)
+            tracks.append(self.pfmdnl_lst_track(m))
+            if int(m.group(2)) + 1 == int(m.group(1)):
+                break
+        if self._snp is None:
+            self._snp = yield self.apfmsnp()
+        raise Return(add_igc_filenames(tracks, 'XFR', self.serial_number))
+
+    @staticmethod
+    def record(packet):
+        if packet.id == 0xa0a0:
+            return FlightInformationRecord(packet.data)
+        elif packet.id == 0xa1a1:
+            return KeyTrackPositionRecord(packet.data)
+        elif packet.id == 0xa2a2:
+            return TrackPositionRecordDeltas(packet.data)
+        else:
+            logger.info('unknown packet type %04X' % packet.id)
+            return None
+
     def ipfmdnl(self, dt, timeout=1):
         self.write(('PFMDNL,%s,' % dt.strftime('%y%m%d%H%M%S')).encode('nmea_sentence'))
         while True:
             packet = self.readpacket(timeout)
-            if packet.id == 0xa0a0:
-                yield FlightInformationRecord(packet.data)
-            elif packet.id == 0xa1a1:
-                yield KeyTrackPositionRecord(packet.data)
-            elif packet.id == 0xa2a2:
-                yield TrackPositionRecordDeltas(packet.data)
-            elif packet.id == 0xa3a3:
+            if packet.id == 0xa3a3:
                 break
-            else:
-                logger.info('unknown packet type %04X' % packet.id)
+            record = self.record(packet)
+            if record is not None:
+                yield record
+
+    def aipfmdnl(self, dt, callback=None, timeout=1):
+        self.write(('PFMDNL,%s,' % dt.strftime('%y%m%d%H%M%S')).encode('nmea_sentence'))
+        decoder = TrackDecoder(self.model, self.serial_number)
+        result = []
+
+        def emit(lines):
+            for line in lines:
+                if callback is None:
+                    result.append(line)
+                else:
+                    callback(line)
+        emit([decoder.header()])
+        while True:
+            packet = yield self.areadpacket(timeout)
+            if packet.id == 0xa3a3:
+                break
+            record = self.record(packet)
+            if record is not None:
+                emit(decoder.decode(record))
+        raise Return(result)
+
+    @staticmethod
+    def pfmwpl_waypoint(m):
+        lat = float(m.group(1))
+        if m.group(2) == 'S':
+            lat = -lat
+        lon = float(m.group(3))
+        if m.group(4) == 'W':
+            lon = -lon
+        alt = int(m.group(5))
+        name = m.group(6)
+        airfield = bool(int(m.group(7)))
+        return Waypoint(name, lat, lon, alt, airfield=airfield)
 
     def ipfmwpl(self):
-        try:
-            for m in self.ieach('PFMWPL,', PFMWPL_RE):
-                lat = float(m.group(1))
-                if m.group(2) == 'S':
-                    lat = -lat
-                lon = float(m.group(3))
-                if m.group(4) == 'W':
-                    lon = -lon
-                alt = int(m.group(5))
-                name = m.group(6)
-                airfield = bool(int(m.group(7)))
-                yield Waypoint(name, lat, lon, alt, airfield=airfield)
-        except TimeoutError:
-            pass  # FIXME
+        for m in self.ieach_until_idle('PFMWPL,', PFMWPL_RE):
+            yield self.pfmwpl_waypoint(m)
+
+    def apfmwpl(self):
+        if self._snp is None:
+            self._snp = yield self.apfmsnp()
+        ms = yield self.aeach_until_idle('PFMWPL,', PFMWPL_RE)
+        raise Return(list(self.pfmwpl_waypoint(m) for m in ms))
 
     def pfmwpl(self):
         return list(self.ipfmwpl())
@@ -338,6 +480,16 @@ class Flymaster(FlightRecorderBase):
     def pilot_name(self):
         return None
 
+    def confirm(self, detection):
+        self._snp = self.pfmsnp()
+        return self.detection == detection
+
+    def forget_identity(self):
+        self._snp = None
+
+    def ping(self):
+        return self.pfmsnp().serial_number == self.serial_number
+
     def set(self, key, value, first=True, last=True):
         if key in ('civl_id', 'competition_id', 'pilot_name'):
             self.pfmids(**{key: value})
@@ -349,9 +501,17 @@ class Flymaster(FlightRecorderBase):
             self._pfmdnl_lst = self.pfmdnl_lst()
         return self._pfmdnl_lst
 
+    def atracks(self):
+        if self._pfmdnl_lst is None:
+            self._pfmdnl_lst = yield self.apfmdnl_lst()
+        raise Return(self._pfmdnl_lst)
+
     def waypoints(self):
         return self.pfmwpl()
 
+    def awaypoints(self):
+        return self.apfmwpl()
+
     def waypoint_upload(self, waypoint):
         return self.pfmwpr(waypoint)
 
@@ -0,0 +1,112 @@
+#   framing.py  Receive buffer and framing shared by all drivers
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+COMPACT_THRESHOLD = 4096
+
+
+class FrameBuffer(object):
+
+    # Received data is appended to a bytearray and consumed by advancing
+    # self.start.  Consumed data is only discarded once it makes up more
+    # than half of the buffer, so each byte is copied a bounded number of
+    # times however it is framed.
+
+    def __init__(self, data=''):
+        self.data = bytearray(data)
+        self.start = 0
+        self.scan = 0
+
+    def __len__(self):
+        return len(self.data) - self.start
+
+    def feed(self, data):
+        self.data.extend(data)
+
+    def clear(self):
+        del self.data[:]
+        self.start = 0
+        self.scan = 0
+
+    def getvalue(self):
+        return memoryview(self.data)[self.start:].tobytes()
+
+    def peek(self, n):
+        if len(self.data) - self.start < n:
+            return None
+        return memoryview(self.data)[self.start:self.start + n].tobytes()
+
+    def read(self, n):
+        result = self.peek(n)
+        if result is not None:
+            self.consume(n)
+        return result
+
+    def consume(self, n):
+        self.start += n
+        if self.start > COMPACT_THRESHOLD and 2 * self.start > len(self.data):
+            del self.data[:self.start]
+            self.scan = max(self.scan - self.start, 0)
+            self.start = 0
+
+    def readmarker(self, markers):
+        if self.start < len(self.data):
+            c = chr(self.data[self.start])
+            if c in markers:
+                self.consume(1)
+                return c
+        return None
+
+    def readline(self, terminator='\n'):
+        index = self.data.find(terminator, max(self.start, self.scan - len(terminator) + 1))
+        if index == -1:
+            self.scan = len(self.data)
+            return None
+        return self.read(index + len(terminator) - self.start)
+
+    def readlines(self, terminator, end):
+        # Returns all complete lines up to the end marker, and whether the
+        # end marker was found, splitting them with a single call to split
+        index = self.data.find(end, self.start)
+        if index == -1:
+            index = self.data.rfind(terminator, self.start)
+            if index == -1:
+                return [], False
+            lines = self.read(index + len(terminator) - self.start).split(terminator)
+            ended = False
+        else:
+            lines = self.read(index - self.start).split(terminator)
+            self.consume(len(end))
+            ended = True
+        last = lines.pop()
+        lines = list(line + terminator for line in lines)
+        if last:
+            lines.append(last)
+        return lines, ended
+
+    def readpacket(self, offset, extra):
+        # A packet has offset bytes of header, a one byte length, length
+        # bytes of data and extra bytes of trailer
+        if len(self.data) - self.start <= offset:
+            return None
+        return self.read(offset + 1 + self.data[self.start + offset] + extra)
+
+    def match(self, re):
+        m = re.match(self.getvalue())
+        if m is None:
+            return None
+        self.consume(m.end())
+        return m
@@ -0,0 +1,138 @@
+#   hotplug.py  Device hotplug watcher and worker pool
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import ctypes
+import ctypes.util
+from fnmatch import fnmatch
+from glob import glob
+import logging
+import os
+import os.path
+from Queue import Queue
+import struct
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct('iIII')
+
+POLL_INTERVAL = 1
+
+
+class Inotify(object):
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd == -1:
+            raise OSError(ctypes.get_errno(), 'inotify_init')
+        self.directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, directory, IN_CREATE | IN_DELETE)
+            if wd == -1:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch')
+            self.directories[wd] = directory
+
+    def read(self):
+        data = os.read(self.fd, 4096)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            yield mask, os.path.join(self.directories[wd], name)
+
+
+class HotplugWatcher(object):
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.devices = set()
+
+    def matches(self, filename):
+        return any(fnmatch(filename, pattern) for pattern in self.patterns)
+
+    def scan(self):
+        return set(filename for pattern in self.patterns for filename in glob(pattern))
+
+    def __iter__(self):
+        directories = set(os.path.dirname(pattern) for pattern in self.patterns)
+        try:
+            inotify = Inotify(directories)
+        except (AttributeError, OSError):
+            logger.info('inotify not available, polling')
+            inotify = None
+        for filename in sorted(self.scan()):
+            self.devices.add(filename)
+            yield filename
+        while True:
+            if inotify is None:
+                time.sleep(POLL_INTERVAL)
+                devices = self.scan()
+                added = sorted(devices - self.devices)
+                self.devices = devices
+            else:
+                added = []
+                for mask, filename in inotify.read():
+                    if not self.matches(filename):
+                        continue
+                    if mask & IN_CREATE:
+                        self.devices.add(filename)
+                        added.append(filename)
+                    elif mask & IN_DELETE:
+                        self.devices.discard(filename)
+            for filename in added:
+                logger.info('%r added' % filename)
+                yield filename
+
+
+class WorkerPool(object):
+
+    def __init__(self, handler, workers=4, backlog=16):
+        self.handler = handler
+        self.queue = Queue(backlog)
+        self.lock = threading.Lock()
+        self.active = set()
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, item):
+        with self.lock:
+            if item in self.active:
+                return
+            self.active.add(item)
+        self.queue.put(item)
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self.handler(item)
+            except Exception:
+                logger.exception('%r failed' % (item,))
+            finally:
+                with self.lock:
+                    self.active.discard(item)
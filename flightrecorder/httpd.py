@@ -0,0 +1,256 @@
+#   httpd.py  HTTP interface to attached flight recorders
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import re
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+import urlparse
+
+from broker import DeviceRegistry
+from common import parse_openair
+from errors import Error, NotAvailableError, TimeoutError
+import waypoint
+
+
+logger = logging.getLogger(__name__)
+
+
+ROUTES = (
+    ('GET', r'/devices\Z', 'get_devices'),
+    ('GET', r'/devices/(\d+)/tracks\Z', 'get_tracks'),
+    ('GET', r'/devices/(\d+)/tracks/(\d+)\.igc\Z', 'get_igc'),
+    ('GET', r'/devices/(\d+)/waypoints\Z', 'get_waypoints'),
+    ('POST', r'/devices/(\d+)/waypoints\Z', 'post_waypoints'),
+    ('POST', r'/devices/(\d+)/ctrs\Z', 'post_ctrs'))
+
+WAYPOINT_FORMATS = 'compegps formatgeo oziexplorer seeyou'.split()
+
+DEFAULT_WARNING_DISTANCE = 2000
+
+
+class HTTPError(RuntimeError):
+
+    def __init__(self, code, message=None):
+        RuntimeError.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive and chunked responses need HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def log_message(self, format, *args):
+        logger.info('%s %s' % (self.address_string(), format % args))
+
+    def route(self, method):
+        url = urlparse.urlsplit(self.path)
+        query = dict((key, values[-1]) for key, values in urlparse.parse_qs(url.query).items())
+        allowed = []
+        for route_method, pattern, name in ROUTES:
+            m = re.match(pattern, url.path)
+            if m is None:
+                continue
+            if route_method != method:
+                allowed.append(route_method)
+                continue
+            try:
+                getattr(self, name)(query, *m.groups())
+            except HTTPError, e:
+                self.send_error(e.code, e.message)
+            return
+        if allowed:
+            # Any request body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            self.send_body('method %s not allowed\n' % method, 'text/plain', 405, (('Allow', ', '.join(allowed)), ('Connection', 'close')))
+        else:
+            self.send_error(404)
+
+    def device(self, serial_number):
+        device = self.server.devices.find(serial_number)
+        if device is None:
+            self.server.open_all()
+            device = self.server.devices.find(serial_number)
+        if device is None:
+            raise HTTPError(404, 'no flight recorder with serial number %s' % serial_number)
+        return device
+
+    def call(self, device, function, *args):
+        # Called with the device's lock held, so that requests from
+        # different clients never interleave on one flight recorder
+        try:
+            return function(*args)
+        except NotAvailableError:
+            raise HTTPError(501, 'not available on this flight recorder')
+        except TimeoutError:
+            self.server.devices.drop(device.fr.io.filename, device)
+            raise HTTPError(504, 'timeout waiting for the flight recorder')
+        except Error, e:
+            self.server.devices.drop(device.fr.io.filename, device)
+            raise HTTPError(502, '%s %s' % (e.__class__.__name__, e.msg or ''))
+        except Exception, e:
+            # A driver bug or a garbled response must not leave the client
+            # without a status or keep the device open in an unknown state
+            logger.exception('%s failed' % self.path)
+            self.server.devices.drop(device.fr.io.filename, device)
+            raise HTTPError(500, '%s %s' % (e.__class__.__name__, e))
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise HTTPError(411)
+        return self.rfile.read(length)
+
+    def send_body(self, body, content_type, code=200, headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, value, code=200):
+        self.send_body(json.dumps(value, indent=4, separators=(',', ': '), sort_keys=True) + '\n', 'application/json', code)
+
+    def get_devices(self, query):
+        result = []
+        for device in self.server.open_all():
+            identity = dict(device.identity)
+            identity['tracks'] = '/devices/%s/tracks' % identity.get('serial_number')
+            identity['waypoints'] = '/devices/%s/waypoints' % identity.get('serial_number')
+            result.append(identity)
+        self.send_json(result)
+
+    def get_tracks(self, query, serial_number):
+        device = self.device(serial_number)
+        with device.lock:
+            tracks = self.call(device, device.fr.tracks)
+        result = []
+        for i, track in enumerate(tracks):
+            track_json = track.to_json()
+            track_json['url'] = '/devices/%s/tracks/%d.igc' % (serial_number, i + 1)
+            result.append(track_json)
+        self.send_json(result)
+
+    def get_igc(self, query, serial_number, index):
+        device = self.device(serial_number)
+        with device.lock:
+            tracks = self.call(device, device.fr.tracks)
+            if not 1 <= int(index) <= len(tracks):
+                raise HTTPError(404, 'no track %s' % index)
+            track = tracks[int(index) - 1]
+            lines = track.igc_stream()
+            # Errors before the first line can still be reported properly
+            first = self.call(device, next, lines, None)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.fai.igc')
+            self.send_header('Content-Disposition', 'attachment; filename="%s"' % track.igc_filename)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                if first is not None:
+                    self.send_chunk(first)
+                    for line in lines:
+                        self.send_chunk(line)
+                self.send_chunk('')
+            except Exception:
+                # The status has already been sent, so all that can be done
+                # is to drop the connection before the final chunk
+                logger.exception('%s failed' % self.path)
+                self.server.devices.drop(device.fr.io.filename, device)
+                self.close_connection = True
+
+    def send_chunk(self, data):
+        self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+
+    def get_waypoints(self, query, serial_number):
+        format = query.get('format', 'formatgeo')
+        if format not in WAYPOINT_FORMATS:
+            raise HTTPError(400, 'unknown waypoint format %r' % format)
+        device = self.device(serial_number)
+        with device.lock:
+            waypoints = self.call(device, lambda: list(device.fr.waypoints()))
+        output = StringIO()
+        waypoint.dump(waypoints, output, format=format)
+        body = output.getvalue()
+        if isinstance(body, unicode):
+            body = body.encode('iso-8859-1')
+        self.send_body(body, 'text/plain; charset=iso-8859-1')
+
+    def post_waypoints(self, query, serial_number):
+        try:
+            waypoints = waypoint.load(StringIO(self.read_body()))
+        except waypoint.WaypointError, e:
+            raise HTTPError(400, str(e))
+        device = self.device(serial_number)
+        result = []
+        with device.lock:
+            for w in waypoints:
+                device_name = self.call(device, device.fr.waypoint_upload, w)
+                result.append(dict(name=w.name, device_name=device_name))
+        self.send_json(result)
+
+    def post_ctrs(self, query, serial_number):
+        try:
+            warning_distance = int(query.get('warning_distance', DEFAULT_WARNING_DISTANCE))
+        except ValueError:
+            raise HTTPError(400, 'invalid warning distance')
+        try:
+            ctrs = list(parse_openair(StringIO(self.read_body())))
+        except ValueError, e:
+            raise HTTPError(400, str(e))
+        device = self.device(serial_number)
+        with device.lock:
+            for ctr in ctrs:
+                self.call(device, device.fr.ctr_upload, ctr, warning_distance)
+        self.send_json(list(ctr.name for ctr in ctrs))
+
+
+class FlightRecorderHTTPServer(ThreadingMixIn, HTTPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, filenames, model=None, cache=None, negotiate=False):
+        HTTPServer.__init__(self, address, RequestHandler)
+        self.filenames = filenames
+        self.devices = DeviceRegistry(model, cache, negotiate)
+
+    def open_all(self):
+        return self.devices.open_all(self.filenames())
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.devices.close()
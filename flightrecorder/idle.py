@@ -0,0 +1,112 @@
+#   idle.py  Adaptive end-of-listing timeouts
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import threading
+import time
+
+from common import atomic_write_json, load_json
+
+
+logger = logging.getLogger(__name__)
+
+
+INITIAL = 1.0
+MINIMUM = 0.3
+FACTOR = 4.0
+DECAY = 0.98
+
+
+class IdleTimeout(object):
+
+    # Some listings have no terminator and end only when the device stops
+    # sending.  Rather than always waiting INITIAL seconds, wait for
+    # FACTOR times the longest gap seen between lines of earlier listings
+    # of the same kind.  Ending a listing early silently loses lines, so
+    # the timeout never drops below MINIMUM and a single quick listing
+    # only lowers it a little.
+
+    def __init__(self, gap=None):
+        self.gap = gap
+
+    @property
+    def timeout(self):
+        if self.gap is None:
+            return INITIAL
+        return min(max(FACTOR * self.gap, MINIMUM), INITIAL)
+
+    def update(self, gap):
+        if self.gap is None:
+            self.gap = gap
+        else:
+            self.gap = max(gap, DECAY * self.gap)
+        logger.info('idle gap %.3fs, timeout %.3fs' % (self.gap, self.timeout))
+
+
+class IdleListing(object):
+
+    # Times the gaps between the lines of one listing.  The first line may
+    # take a while to come, so it is not counted.
+
+    def __init__(self, idle, timeout=INITIAL):
+        self.idle = idle
+        self.first_timeout = timeout
+        self.lines = 0
+        self.gap = 0
+        self.start = None
+
+    def timeout(self):
+        self.start = time.time()
+        return self.idle.timeout if self.lines else self.first_timeout
+
+    def received(self):
+        if self.lines:
+            self.gap = max(self.gap, time.time() - self.start)
+        self.lines += 1
+
+    def finished(self):
+        if self.gap:
+            self.idle.update(self.gap)
+
+
+_idle_timeouts = {}
+_lock = threading.Lock()
+
+
+def idle_timeout(model, software_version, command):
+    key = '%s/%s/%s' % (model, software_version, command)
+    with _lock:
+        if key not in _idle_timeouts:
+            _idle_timeouts[key] = IdleTimeout()
+        return _idle_timeouts[key]
+
+
+def load(filename):
+    for key, gap in load_json(filename, {}).items():
+        _idle_timeouts[key] = IdleTimeout(gap)
+
+
+def save(filename):
+    # Daemon workers save after each device, so saves are serialised
+    with _lock:
+        gaps = dict((key, it.gap) for key, it in _idle_timeouts.items() if it.gap is not None)
+        if not gaps:
+            return
+        try:
+            atomic_write_json(filename, gaps)
+        except (IOError, OSError):
+            logger.warning('cannot save idle timeouts to %r' % filename)
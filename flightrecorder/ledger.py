@@ -0,0 +1,90 @@
+#   ledger.py  Persistent record of downloaded tracklogs
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import logging
+import os.path
+import threading
+
+from common import atomic_write_json, load_json
+
+
+logger = logging.getLogger(__name__)
+
+
+def track_key(manufacturer, serial_number, track):
+    # Tracklogs are identified by what the flight recorder reports in its
+    # track list, not by file name, so moving or renaming downloaded files
+    # does not cause them to be downloaded again
+    duration = track.duration.days * 86400 + track.duration.seconds
+    return '%s/%s/%s/%d' % (manufacturer, serial_number, track.datetime.strftime('%Y-%m-%dT%H:%M:%S'), duration)
+
+
+def archive_location(filename, name):
+    return '%s#%s' % (os.path.abspath(filename), name)
+
+
+class Download(object):
+
+    def __init__(self, ledger, key):
+        self.ledger = ledger
+        self.key = key
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def lines(self, lines):
+        for line in lines:
+            self.sha1.update(line)
+            self.size += len(line)
+            yield line
+
+    def done(self, location):
+        self.ledger.record(self.key, self.sha1.hexdigest(), self.size, location)
+
+
+class Ledger(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = load_json(self.filename, {})
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def known(self, manufacturer, serial_number, track):
+        return self.get(track_key(manufacturer, serial_number, track)) is not None
+
+    def download(self, manufacturer, serial_number, track):
+        return Download(self, track_key(manufacturer, serial_number, track))
+
+    def record(self, key, sha1, size, location):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['sha1'] != sha1:
+                entry = self.entries[key] = dict(sha1=sha1, size=size, locations=[])
+            if location in entry['locations']:
+                return
+            entry['locations'].append(location)
+            self.save()
+
+    def save(self):
+        try:
+            atomic_write_json(self.filename, self.entries)
+        except (IOError, OSError):
+            logger.warning('cannot save download ledger to %r' % self.filename)
@@ -0,0 +1,169 @@
+#   metrics.py  Per-command latency and throughput metrics
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import re
+import threading
+import time
+
+from common import atomic_write, atomic_write_json
+
+
+logger = logging.getLogger(__name__)
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COMMAND_RE = re.compile(r'\A\$?(ACT_[0-9A-F]{2}|[A-Z]{3,})')
+
+HELP = {
+    'flightrecorder_bytes_read_total': 'Bytes read from the flight recorder.',
+    'flightrecorder_bytes_written_total': 'Bytes written to the flight recorder.',
+    'flightrecorder_checksum_errors_total': 'Packets received with a bad checksum.',
+    'flightrecorder_command_latency_seconds': 'Time from sending a command to receiving the first byte of its response.',
+    'flightrecorder_command_seconds_total': 'Time spent receiving responses.',
+    'flightrecorder_commands_total': 'Commands sent.',
+    'flightrecorder_lines_total': 'Lines received.',
+    'flightrecorder_naks_total': 'Negative acknowledgements sent.',
+    'flightrecorder_packets_total': 'Binary packets received.',
+    'flightrecorder_timeouts_total': 'Reads that timed out.'}
+
+
+def command_name(data):
+    m = COMMAND_RE.match(data)
+    return m.group(1) if m else None
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bucket in enumerate(BUCKETS):
+                if value <= bucket:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        result = {}
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = result.setdefault(name, dict(type='counter', values=[]))
+                metric['values'].append(dict(labels=dict(labels), value=value))
+            for (name, labels), (buckets, sum, count) in sorted(self.histograms.items()):
+                metric = result.setdefault(name, dict(type='histogram', values=[]))
+                metric['values'].append(dict(labels=dict(labels), buckets=dict(zip(map(str, BUCKETS), buckets)), sum=sum, count=count))
+        return result
+
+    def prometheus(self):
+        lines = []
+
+        def format_labels(labels, **extra):
+            labels = sorted(labels.items()) + sorted(extra.items())
+            return '{%s}' % ','.join('%s="%s"' % (key, value) for key, value in labels) if labels else ''
+        for name, metric in sorted(self.snapshot().items()):
+            if name in HELP:
+                lines.append('# HELP %s %s' % (name, HELP[name]))
+            lines.append('# TYPE %s %s' % (name, metric['type']))
+            for value in metric['values']:
+                if metric['type'] == 'counter':
+                    lines.append('%s%s %s' % (name, format_labels(value['labels']), value['value']))
+                    continue
+                for bucket in BUCKETS:
+                    lines.append('%s_bucket%s %d' % (name, format_labels(value['labels'], le=bucket), value['buckets'][str(bucket)]))
+                lines.append('%s_bucket%s %d' % (name, format_labels(value['labels'], le='+Inf'), value['count']))
+                lines.append('%s_sum%s %s' % (name, format_labels(value['labels']), value['sum']))
+                lines.append('%s_count%s %d' % (name, format_labels(value['labels']), value['count']))
+        return ''.join(line + '\n' for line in lines)
+
+    def save(self, filename):
+        # Written atomically so that a node exporter never sees a partial
+        # file, and serialised because daemon workers save concurrently
+        with self.lock:
+            try:
+                if filename.endswith('.json'):
+                    atomic_write_json(filename, self.snapshot())
+                else:
+                    atomic_write(filename, self.prometheus())
+            except (IOError, OSError):
+                logger.warning('cannot save metrics to %r' % filename)
+
+
+registry = Registry()
+
+
+class CommandMetrics(object):
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.command = 'none'
+        self.start = None
+        self.mark = None
+
+    def write(self, data):
+        command = command_name(data)
+        if command is not None:
+            self.command = command
+            self.start = self.mark = time.time()
+            self.registry.inc('flightrecorder_commands_total', command=command)
+        self.registry.inc('flightrecorder_bytes_written_total', len(data), command=self.command)
+
+    def read(self, data):
+        now = time.time()
+        if self.start is not None:
+            self.registry.observe('flightrecorder_command_latency_seconds', now - self.start, command=self.command)
+            self.start = None
+        if self.mark is not None:
+            self.registry.inc('flightrecorder_command_seconds_total', now - self.mark, command=self.command)
+        self.mark = now
+        self.registry.inc('flightrecorder_bytes_read_total', len(data), command=self.command)
+
+    def timeout(self):
+        # Time spent waiting for a timeout is not counted as receiving time
+        self.mark = time.time()
+        self.registry.inc('flightrecorder_timeouts_total', command=self.command)
+
+    def lines(self, n=1):
+        if n:
+            self.registry.inc('flightrecorder_lines_total', n, command=self.command)
+
+    def packet(self):
+        self.registry.inc('flightrecorder_packets_total', command=self.command)
+
+    def checksum_error(self):
+        self.registry.inc('flightrecorder_checksum_errors_total', command=self.command)
+
+    def nak(self):
+        self.registry.inc('flightrecorder_naks_total', command=self.command)
@@ -0,0 +1,187 @@
+#   reactor.py  Single-threaded event loop for driving many flight recorders
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import heapq
+import select
+import sys
+import time
+
+
+class Return(Exception):
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Future(object):
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.exc_info = None
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, value):
+        self.value = value
+        self._done()
+
+    def set_exception(self, exc_info):
+        self.exc_info = exc_info
+        self._done()
+
+    def result(self):
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def _done(self):
+        if self.done:
+            raise RuntimeError('future already done')
+        self.done = True
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Timer(object):
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Task(Future):
+
+    def __init__(self, reactor, generator):
+        Future.__init__(self)
+        self.reactor = reactor
+        self.generator = generator
+        self.reactor.call_soon(self.step)
+
+    def step(self, future=None):
+        try:
+            if future is None:
+                yielded = self.generator.next()
+            elif future.exc_info is not None:
+                yielded = self.generator.throw(*future.exc_info)
+            else:
+                yielded = self.generator.send(future.value)
+        except StopIteration:
+            self.set_result(None)
+        except Return, r:
+            self.set_result(r.value)
+        except Exception:
+            self.set_exception(sys.exc_info())
+        else:
+            if not isinstance(yielded, Future):
+                yielded = self.reactor.task(yielded)
+            yielded.add_done_callback(lambda f: self.reactor.call_soon(self.step, f))
+
+
+class Reactor(object):
+
+    def __init__(self):
+        self.readers = {}
+        self.ready = []
+        self.timers = []
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd, None)
+
+    def call_soon(self, callback, *args):
+        self.ready.append((callback, args))
+
+    def call_later(self, delay, callback):
+        timer = Timer(time.time() + delay, callback)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def task(self, generator):
+        return Task(self, generator)
+
+    def run_once(self):
+        while self.timers and self.timers[0].cancelled:
+            heapq.heappop(self.timers)
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            timeout = max(self.timers[0].when - time.time(), 0)
+        else:
+            timeout = None
+        if self.readers or timeout is not None:
+            fds = select.select(list(self.readers.keys()), [], [], timeout)[0]
+        else:
+            fds = []
+        for fd in fds:
+            callback = self.readers.get(fd)
+            if callback is not None:
+                callback()
+        now = time.time()
+        while self.timers and self.timers[0].when <= now:
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback()
+        ready, self.ready = self.ready, []
+        for callback, args in ready:
+            callback(*args)
+
+    def run_until_complete(self, future):
+        if not isinstance(future, Future):
+            future = self.task(future)
+        while not future.done:
+            self.run_once()
+        return future.result()
+
+    def gather(self, *futures):
+        result = Future()
+        values = [None] * len(futures)
+        remaining = [len(futures)]
+
+        def done(index, future):
+            if result.done:
+                return
+            if future.exc_info is not None:
+                result.set_exception(future.exc_info)
+                return
+            values[index] = future.value
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                result.set_result(values)
+        if not futures:
+            result.set_result(values)
+        for index, future in enumerate(futures):
+            if not isinstance(future, Future):
+                future = self.task(future)
+            future.add_done_callback(lambda f, index=index: done(index, f))
+        return result
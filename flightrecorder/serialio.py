@@ -15,23 +15,44 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from contextlib import contextmanager
+import errno
+import fcntl
 import logging
 import os
 import select
+import sys
 import termios
 import time
 import tty
 
 
-from errors import TimeoutError, WriteError
+from errors import DisconnectError, TimeoutError, WriteError
+from reactor import Future, Return
+from timing import WIRE, timer
+from transport import DEFAULT_SPEED, Transport
+from usb import find_usb_identity, native_usb, usb_identity
+from wiretrace import DISCONNECT, READ, TIMEOUT, WRITE, ring
 
 
 logger = logging.getLogger(__name__)
 
 
-class SerialIO(object):
+BATCH_READ_SIZE = 4096
 
-    def __init__(self, filename, speed=tty.B57600):
+RECONNECT_TIMEOUT = 10
+RECONNECT_INTERVAL = 0.25
+
+
+class SerialIO(Transport):
+
+    def __init__(self, filename, speed=DEFAULT_SPEED):
+        self.fd = None
+        self.open(filename, speed)
+        self.identity = usb_identity(filename)
+        self.speed_negotiable = native_usb(filename)
+
+    def open(self, filename, speed):
         try:
             self.filename = filename
             logger.info('opening %r' % filename)
@@ -41,30 +62,190 @@ class SerialIO(object):
             attr[tty.ISPEED] = attr[tty.OSPEED] = speed
             tty.tcsetattr(self.fd, tty.TCSAFLUSH, attr)
         except termios.error:
+            self.close()
             raise IOError
+        self.speed = speed
+        self.read_size = 1024
+
+    def reconnect(self, timeout=RECONNECT_TIMEOUT):
+        # USB serial adapters that drop off the bus usually come back
+        # under a different device name, so find them by their USB identity
+        self.close()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.identity is None:
+                filename = self.filename
+            else:
+                filename = find_usb_identity(self.identity)
+            if filename is not None:
+                try:
+                    self.open(filename, self.speed)
+                    return
+                except (IOError, OSError):
+                    pass
+            time.sleep(RECONNECT_INTERVAL)
+        raise DisconnectError(self.filename)
+
+    def disconnected(self):
+        logger.warning('%r disconnected' % self.filename)
+        ring.record(DISCONNECT, self.filename)
+        self.close()
+        raise DisconnectError(self.filename)
 
     def set_speed(self, speed):
+        self.speed = speed
         attr = tty.tcgetattr(self.fd)
         attr[tty.ISPEED] = attr[tty.OSPEED] = speed
         tty.tcsetattr(self.fd, tty.TCSAFLUSH, attr)
 
-    def read(self, timeout=1, n=1024):
-        if select.select([self.fd], [], [], timeout) == ([], [], []):
-            raise TimeoutError
-        data = os.read(self.fd, n)
-        logger.debug('%.3f read %r (%d bytes)' % (time.time(), data, len(data)))
-        return data
+    def set_batching(self, vmin, vtime):
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        if vmin:
+            flags &= ~os.O_NONBLOCK
+        else:
+            flags |= os.O_NONBLOCK
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags)
+        attr = tty.tcgetattr(self.fd)
+        attr[tty.CC][termios.VMIN] = vmin
+        attr[tty.CC][termios.VTIME] = vtime
+        tty.tcsetattr(self.fd, tty.TCSANOW, attr)
+        self.read_size = BATCH_READ_SIZE if vmin else 1024
 
-    def readn(self, n, timeout=1):
-        data = ''
-        while len(data) < n:
-            data += self.read(timeout, n - len(data))
+    @contextmanager
+    def batching(self, vmin=255, vtime=1):
+        # Once select has seen the first byte, a blocking read returns
+        # when vmin bytes have arrived or when the line has been idle for
+        # vtime tenths of a second, so streamed responses arrive in large
+        # chunks instead of one small read per select
+        self.set_batching(vmin, vtime)
+        try:
+            yield
+        finally:
+            if self.fd is not None:
+                self.set_batching(0, 0)
+
+    @contextmanager
+    def flow_control(self):
+        # Only input flow control is enabled: with IXOFF the kernel sends
+        # XOFF to the device when its input queue fills.  IXON is left
+        # clear because the kernel would then swallow the XOFF and XON
+        # characters that Flytec and Brauniger devices use to delimit
+        # their responses.
+        attr = tty.tcgetattr(self.fd)
+        iflag = attr[tty.IFLAG]
+        attr[tty.IFLAG] = iflag | termios.IXOFF
+        tty.tcsetattr(self.fd, tty.TCSANOW, attr)
+        try:
+            yield
+        finally:
+            if self.fd is not None:
+                attr = tty.tcgetattr(self.fd)
+                attr[tty.IFLAG] = iflag
+                tty.tcsetattr(self.fd, tty.TCSANOW, attr)
+
+    def read(self, timeout=1, n=None):
+        if self.fd is None:
+            raise DisconnectError(self.filename)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                with timer.phase(WIRE):
+                    if select.select([self.fd], [], [], max(deadline - time.time(), 0)) == ([], [], []):
+                        self.metrics.timeout()
+                        ring.record(TIMEOUT, self.filename)
+                        raise TimeoutError
+                    data = os.read(self.fd, n or self.read_size)
+                break
+            except (OSError, select.error), e:
+                # A signal arriving during the wait is not a disconnect
+                if not e.args or e.args[0] != errno.EINTR:
+                    self.disconnected()
+        if not data:
+            self.disconnected()
+        self.metrics.read(data)
+        ring.record(READ, self.filename, data)
         return data
 
     def write(self, line):
-        logger.debug('%.3f write %r (%d bytes)' % (time.time(), line, len(line)))
-        if os.write(self.fd, line) != len(line):
-            raise WriteError
+        if self.fd is None:
+            raise DisconnectError(self.filename)
+        self.metrics.write(line)
+        ring.record(WRITE, self.filename, line)
+        try:
+            with timer.phase(WIRE):
+                if os.write(self.fd, line) != len(line):
+                    raise WriteError
+        except OSError:
+            self.disconnected()
 
     def flush(self):
-        tty.tcflush(self.fd, tty.TCIOFLUSH)
+        if self.fd is None:
+            return
+        try:
+            tty.tcflush(self.fd, tty.TCIOFLUSH)
+        except termios.error:
+            self.disconnected()
+
+    def close(self):
+        if self.fd is not None:
+            logger.info('closing %r' % self.filename)
+            os.close(self.fd)
+            self.fd = None
+
+
+class AsyncSerialIO(SerialIO):
+
+    def __init__(self, reactor, filename, speed=DEFAULT_SPEED):
+        SerialIO.__init__(self, filename, speed)
+        self.reactor = reactor
+
+    @contextmanager
+    def batching(self, vmin=255, vtime=1):
+        yield
+
+    # Drivers on an asynchronous transport only support their a* methods
+    def read(self, timeout=1, n=None):
+        raise RuntimeError('%r is asynchronous, use the asynchronous driver methods' % self.filename)
+
+    def readn(self, n, timeout=1):
+        raise RuntimeError('%r is asynchronous, use the asynchronous driver methods' % self.filename)
+
+    def aread(self, timeout=1, n=1024):
+        future = Future()
+
+        def readable():
+            try:
+                data = os.read(self.fd, n)
+            except OSError, e:
+                if e.errno in (errno.EINTR, errno.EAGAIN):
+                    return
+                data = ''
+            self.reactor.remove_reader(self.fd)
+            timeout_call.cancel()
+            # As with the synchronous read, end of file or an error means
+            # that the device has been unplugged
+            if not data:
+                try:
+                    self.disconnected()
+                except DisconnectError:
+                    future.set_exception(sys.exc_info())
+                return
+            self.metrics.read(data)
+            ring.record(READ, self.filename, data)
+            future.set_result(data)
+
+        def timed_out():
+            self.reactor.remove_reader(self.fd)
+            self.metrics.timeout()
+            ring.record(TIMEOUT, self.filename)
+            future.set_exception((TimeoutError, TimeoutError(), None))
+
+        timeout_call = self.reactor.call_later(timeout, timed_out)
+        self.reactor.add_reader(self.fd, readable)
+        return future
+
+    def areadn(self, n, timeout=1):
+        data = bytearray()
+        while len(data) < n:
+            data.extend((yield self.aread(timeout, n - len(data))))
+        raise Return(str(data))
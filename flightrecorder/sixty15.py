@@ -24,7 +24,10 @@ import time
 
 from base import FlightRecorderBase
 from common import Track, add_igc_filenames
+from drivers import MODELS
 from errors import FlashError, NotAvailableError, ProtocolError, ReadError
+from framing import FrameBuffer
+from reactor import Return
 from utc import UTC
 from waypoint import Waypoint
 
@@ -146,7 +149,7 @@ FLASH_RESPONSE_RE = re.compile(r'(S007Flash6015_V1F8|S0056015Wait39|S004Erase_4C
 
 class Sixty15(FlightRecorderBase):
 
-    SUPPORTED_MODELS = '6015 IQ-BASIC'.split()
+    SUPPORTED_MODELS = MODELS['Sixty15']
 
     ATTRIBUTES = {
         'Flytec 6015': {'manufacturer': 'Flytec', 'model': '6015'},
@@ -154,7 +157,7 @@ class Sixty15(FlightRecorderBase):
 
     def __init__(self, io, line=None):
         self.io = io
-        self.buffer = ''
+        self.buffer = FrameBuffer()
         self._bd = line.rstrip() if line else None
         self._serial_number = None
         self._manufacturer = None
@@ -167,20 +170,27 @@ class Sixty15(FlightRecorderBase):
 
     def readline(self, timeout=1):
         while True:
-            index = self.buffer.find('\r\n')
-            if index == -1:
-                data = self.io.read(timeout)
-                if len(data) == 0:
-                    raise ReadError
-                self.buffer += data
-            else:
-                line = self.buffer[:index + 2]
-                self.buffer = self.buffer[index + 2:]
-                logger.info('readline %r' % line)
+            line = self.buffer.readline('\r\n')
+            if line is not None:
+                self.io.metrics.lines()
                 return line
+            data = self.io.read(timeout)
+            if len(data) == 0:
+                raise ReadError
+            self.buffer.feed(data)
+
+    def areadline(self, timeout=1):
+        while True:
+            line = self.buffer.readline('\r\n')
+            if line is not None:
+                self.io.metrics.lines()
+                raise Return(line)
+            data = yield self.io.aread(timeout)
+            if len(data) == 0:
+                raise ReadError
+            self.buffer.feed(data)
 
     def write(self, line):
-        logger.info('write %r' % line)
         self.io.write(line)
 
     def act1x(self, x, table):
@@ -203,48 +213,81 @@ class Sixty15(FlightRecorderBase):
     def act11(self):
         self.act1x(0x11, PA_FORMAT)
 
+    def act20_track(self, line):
+        fields = re.split(r'\s*;\s*', line)
+        index = int(fields[0])
+        year, month, day = (int(x) for x in fields[1].split('.'))
+        hour, minute, second = (int(x) for x in fields[2].split(':'))
+        hours, minutes, seconds = (int(x) for x in fields[4].split(':'))
+        return Track(
+            index=index,
+            datetime=datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC()),
+            utc_offset=int(fields[3]),
+            duration=datetime.timedelta(seconds=3600 * hours + 60 * minutes + seconds),
+            altitude_offset=int(fields[5]),
+            altitude_max=int(fields[6]),
+            altitude_min=int(fields[7]),
+            vario_max=float(fields[8]),
+            vario_min=float(fields[9]),
+            speed_max=float(fields[10]),
+            pilot_name=fields[11].strip(),
+            glider_type=fields[12].strip(),
+            glider_id=fields[13].strip(),
+            _igc_lambda=self.resumable(lambda: self.iact21(index)),
+            _aigc_lambda=lambda callback: self.aiact21(index, callback))
+
     def act20(self):
         self.write('ACT_20_00\r\n')
         line = self.readline(0.5)
         if re.match('\A\s*No\s+Data\s*\r\n\Z', line):
             return []
         tracks = []
-
-        def igc_lambda(self, index):
-            return lambda: self.iact21(index)
         while True:
             if line == ' Done\r\n':
                 break
-            fields = re.split(r'\s*;\s*', line)
-            index = int(fields[0])
-            year, month, day = (int(x) for x in fields[1].split('.'))
-            hour, minute, second = (int(x) for x in fields[2].split(':'))
-            hours, minutes, seconds = (int(x) for x in fields[4].split(':'))
-            tracks.append(Track(
-                index=index,
-                datetime=datetime.datetime(year + 2000, month, day, hour, minute, second, tzinfo=UTC()),
-                utc_offset=int(fields[3]),
-                duration=datetime.timedelta(seconds=3600 * hours + 60 * minutes + seconds),
-                altitude_offset=int(fields[5]),
-                altitude_max=int(fields[6]),
-                altitude_min=int(fields[7]),
-                vario_max=float(fields[8]),
-                vario_min=float(fields[9]),
-                speed_max=float(fields[10]),
-                pilot_name=fields[11].strip(),
-                glider_type=fields[12].strip(),
-                glider_id=fields[13].strip(),
-                _igc_lambda=igc_lambda(self, index)))
+            tracks.append(self.act20_track(line))
             line = self.readline(0.5)
         return add_igc_filenames(tracks, self.manufacturer[:3].upper(), self.serial_number)
 
+    def aact20(self):
+        self.write('ACT_20_00\r\n')
+        line = yield self.areadline(0.5)
+        if re.match('\A\s*No\s+Data\s*\r\n\Z', line):
+            raise Return([])
+        tracks = []
+        while True:
+            if line == ' Done\r\n':
+                break
+            tracks.append(self.act20_track(line))
+            line = yield self.areadline(0.5)
+        if self._bd is None:
+            self.write('ACT_BD_00\r\n')
+            self._bd = (yield self.areadline()).strip()
+        if self._serial_number is None:
+            self._serial_number = (yield self.arpa(PA_DeviceNr))[0]
+        raise Return(add_igc_filenames(tracks, self.manufacturer[:3].upper(), self.serial_number))
+
     def iact21(self, index):
+        with self.io.batching():
+            self.write('ACT_21_%02X\r\n' % index)
+            while True:
+                line = self.readline()
+                yield line
+                if line.startswith('G'):
+                    break
+
+    def aiact21(self, index, callback=None):
         self.write('ACT_21_%02X\r\n' % index)
+        result = []
         while True:
-            line = self.readline()
-            yield line
+            line = yield self.areadline()
+            if callback is None:
+                result.append(line)
+            else:
+                callback(line)
             if line.startswith('G'):
                 break
+        raise Return(result)
 
     def act22(self, index):
         self.write('ACT_22_00\r\n')
@@ -262,6 +305,22 @@ class Sixty15(FlightRecorderBase):
         if line != ' Done\r\n':
             raise ProtocolError('unexpected response %r' % line)
 
+    @staticmethod
+    def act31_waypoint(line):
+        m = re.match(r'\A(.*?);([NS])\s+(\d+)\'(\d+\.\d+);([EW])\s+(\d+)\'(\d+\.\d+);\s*(\d+);\s*(\d+)\r\n', line)
+        if not m:
+            raise ProtocolError('unexpected response %r' % line)
+        name = m.group(1)
+        lat = int(m.group(3)) + float(m.group(4)) / 60.0
+        if m.group(2) == 'S':
+            lat = -lat
+        lon = int(m.group(6)) + float(m.group(7)) / 60.0
+        if m.group(5) == 'W':
+            lon = -lon
+        alt = int(m.group(8))
+        radius = int(m.group(9))
+        return Waypoint(name, lat, lon, alt, radius=radius)
+
     def iact31(self):
         self.write('ACT_31_00\r\n')
         line = self.readline()
@@ -270,22 +329,22 @@ class Sixty15(FlightRecorderBase):
         while True:
             if line == ' Done\r\n':
                 break
-            m = re.match(r'\A(.*?);([NS])\s+(\d+)\'(\d+\.\d+);([EW])\s+(\d+)\'(\d+\.\d+);\s*(\d+);\s*(\d+)\r\n', line)
-            if m:
-                name = m.group(1)
-                lat = int(m.group(3)) + float(m.group(4)) / 60.0
-                if m.group(2) == 'S':
-                    lat = -lat
-                lon = int(m.group(6)) + float(m.group(7)) / 60.0
-                if m.group(5) == 'W':
-                    lon = -lon
-                alt = int(m.group(8))
-                radius = int(m.group(9))
-                yield Waypoint(name, lat, lon, alt, radius=radius)
-            else:
-                raise ProtocolError('unexpected response %r' % line)
+            yield self.act31_waypoint(line)
             line = self.readline()
 
+    def aact31(self):
+        self.write('ACT_31_00\r\n')
+        waypoints = []
+        line = yield self.areadline()
+        if line == 'No Data\r\n':
+            raise Return(waypoints)
+        while True:
+            if line == ' Done\r\n':
+                break
+            waypoints.append(self.act31_waypoint(line))
+            line = yield self.areadline()
+        raise Return(waypoints)
+
     def act31(self):
         return list(self.iact31())
 
@@ -322,9 +381,7 @@ class Sixty15(FlightRecorderBase):
         self.write('ACT_BD_00\r\n')
         return self.readline().strip()
 
-    def rxa(self, x, parameter, format):
-        self.write('R%cA_%02X\r\n' % (x, parameter))
-        line = self.readline(0.2)
+    def rxa_value(self, x, parameter, format, line):
         m = re.match(r'\AR%cA_%02X_((?:[0-9A-F]{2})*)\r\n\Z' % (x, parameter), line)
         if m:
             return struct.unpack(format, ''.join(chr(int(x, 16)) for x in re.findall(r'..', m.group(1))))
@@ -333,12 +390,24 @@ class Sixty15(FlightRecorderBase):
         else:
             raise ProtocolError('unexpected response %r' % line)
 
+    def rxa(self, x, parameter, format):
+        self.write('R%cA_%02X\r\n' % (x, parameter))
+        return self.rxa_value(x, parameter, format, self.readline(0.2))
+
+    def arxa(self, x, parameter, format):
+        self.write('R%cA_%02X\r\n' % (x, parameter))
+        line = yield self.areadline(0.2)
+        raise Return(self.rxa_value(x, parameter, format, line))
+
     def rfa(self, parameter):
         return self.rxa('F', parameter, FA_FORMAT[parameter])
 
     def rpa(self, parameter):
         return self.rxa('P', parameter, PA_FORMAT[parameter])
 
+    def arpa(self, parameter):
+        return self.arxa('P', parameter, PA_FORMAT[parameter])
+
     def wfa(self, parameter, value):
         format = FA_FORMAT[parameter]
         m = re.match(r'(\d+)s\Z', format)
@@ -359,11 +428,9 @@ class Sixty15(FlightRecorderBase):
 
     def read_flash_response(self, expected='S003Done16', timeout=1):
         while True:
-            m = FLASH_RESPONSE_RE.match(self.buffer)
+            m = self.buffer.match(FLASH_RESPONSE_RE)
             if m:
                 response = m.group(1)
-                self.buffer = self.buffer[len(m.group(1)):]
-                logger.info('read %r' % response)
                 if expected and response != expected:
                     raise FlashError('expected %r, got %r' % (expected, response))
                 return response
@@ -371,7 +438,7 @@ class Sixty15(FlightRecorderBase):
                 data = self.io.read(timeout)
                 if len(data) == 0:
                     raise ReadError
-                self.buffer += data
+                self.buffer.feed(data)
 
     def flash(self, model, srf):
         if model != '6015':
@@ -424,6 +491,29 @@ class Sixty15(FlightRecorderBase):
             self._pilot_name = self.rfa(FA_Owner)[0].strip()
         return self._pilot_name
 
+    @property
+    def detection(self):
+        detection = FlightRecorderBase.detection.fget(self)
+        detection['bd'] = self._bd
+        return detection
+
+    def confirm(self, detection):
+        self._bd = detection['bd']
+        self._serial_number = self.rpa(PA_DeviceNr)[0]
+        if self._serial_number != detection['serial_number']:
+            return False
+        return self.detection == detection
+
+    def forget_identity(self):
+        self._serial_number = None
+        self._manufacturer = None
+        self._model = None
+        self._software_version = None
+        self._pilot_name = None
+
+    def ping(self):
+        return self.rpa(PA_DeviceNr)[0] == self.serial_number
+
     def get(self, key):
         if key not in FA_MAP:
             raise NotAvailableError
@@ -443,9 +533,17 @@ class Sixty15(FlightRecorderBase):
             self._tracks = self.act20()
         return self._tracks
 
+    def atracks(self):
+        if self._tracks is None:
+            self._tracks = yield self.aact20()
+        raise Return(self._tracks)
+
     def waypoints(self):
         return self.iact31()
 
+    def awaypoints(self):
+        return self.aact31()
+
     def waypoint_remove(self, name=None):
         if name:
             raise NotAvailableError
@@ -0,0 +1,239 @@
+#   tcpio.py  TCP serial bridge (ser2net, RFC 2217) transport
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import errno
+import logging
+import re
+import select
+import socket
+import struct
+import threading
+import time
+
+from errors import DisconnectError, NotAvailableError, TimeoutError
+from timing import WIRE, timer
+from transport import BAUD_RATES, Transport
+from wiretrace import DISCONNECT, READ, TIMEOUT, WRITE, ring
+
+
+logger = logging.getLogger(__name__)
+
+
+RECONNECT_TIMEOUT = 10
+RECONNECT_INTERVAL = 0.25
+
+TCP_DEVICE_RE = re.compile(r'\A(tcp|rfc2217)://([^:/]+):(\d+)/?\Z')
+
+IAC = '\xff'
+DONT = '\xfe'
+DO = '\xfd'
+WONT = '\xfc'
+WILL = '\xfb'
+SB = '\xfa'
+SE = '\xf0'
+COM_PORT_OPTION = '\x2c'
+SET_BAUDRATE = '\x01'
+PURGE_DATA = '\x0c'
+PURGE_BOTH_BUFFERS = '\x03'
+
+
+class TCPIO(Transport):
+
+    def __init__(self, host, port, rfc2217=False, pool=None):
+        self.filename = '%s://%s:%d' % ('rfc2217' if rfc2217 else 'tcp', host, port)
+        self.rfc2217 = rfc2217
+        self.speed_negotiable = rfc2217
+        self.key = (host, port, rfc2217)
+        self.pool = pool
+        self.socket = None
+        self.connect()
+
+    def connect(self):
+        logger.info('connecting to %r' % self.filename)
+        self.socket = socket.create_connection(self.key[:2])
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.telnet = ''
+        if self.rfc2217:
+            self.socket.sendall(IAC + WILL + COM_PORT_OPTION)
+            self.set_speed(self.speed)
+
+    def reconnect(self, timeout=RECONNECT_TIMEOUT):
+        self.disconnect()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self.connect()
+                return
+            except socket.error:
+                time.sleep(RECONNECT_INTERVAL)
+        raise DisconnectError(self.filename)
+
+    def disconnected(self):
+        logger.warning('%r disconnected' % self.filename)
+        ring.record(DISCONNECT, self.filename)
+        self.disconnect()
+        raise DisconnectError(self.filename)
+
+    def subnegotiate(self, data):
+        self.socket.sendall(IAC + SB + COM_PORT_OPTION + data.replace(IAC, IAC + IAC) + IAC + SE)
+
+    def set_speed(self, speed):
+        if not self.rfc2217:
+            raise NotAvailableError
+        self.subnegotiate(SET_BAUDRATE + struct.pack('>I', BAUD_RATES[speed]))
+        self.speed = speed
+
+    def unescape(self, data):
+        # Strip telnet commands and subnegotiations from the data stream,
+        # keeping any incomplete command for the next read
+        data = self.telnet + data
+        self.telnet = ''
+        result = []
+        i = 0
+        while True:
+            j = data.find(IAC, i)
+            if j == -1:
+                result.append(data[i:])
+                break
+            result.append(data[i:j])
+            if j + 1 >= len(data):
+                self.telnet = data[j:]
+                break
+            command = data[j + 1]
+            if command == IAC:
+                result.append(IAC)
+                i = j + 2
+            elif command in (DO, DONT, WILL, WONT):
+                if j + 2 >= len(data):
+                    self.telnet = data[j:]
+                    break
+                i = j + 3
+            elif command == SB:
+                k = data.find(IAC + SE, j + 2)
+                if k == -1:
+                    self.telnet = data[j:]
+                    break
+                i = k + 2
+            else:
+                i = j + 2
+        return ''.join(result)
+
+    def read(self, timeout=1, n=None):
+        if self.socket is None:
+            raise DisconnectError(self.filename)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                with timer.phase(WIRE):
+                    if select.select([self.socket], [], [], max(deadline - time.time(), 0)) == ([], [], []):
+                        self.metrics.timeout()
+                        ring.record(TIMEOUT, self.filename)
+                        raise TimeoutError
+                    data = self.socket.recv(n or 4096)
+            except (socket.error, select.error), e:
+                # A signal arriving during the wait is not a disconnect
+                if e.args and e.args[0] == errno.EINTR:
+                    continue
+                self.disconnected()
+            if not data:
+                self.disconnected()
+            if not self.rfc2217:
+                break
+            data = self.unescape(data)
+            if data:
+                break
+        self.metrics.read(data)
+        ring.record(READ, self.filename, data)
+        return data
+
+    def write(self, line):
+        if self.socket is None:
+            raise DisconnectError(self.filename)
+        self.metrics.write(line)
+        ring.record(WRITE, self.filename, line)
+        try:
+            with timer.phase(WIRE):
+                self.socket.sendall(line.replace(IAC, IAC + IAC) if self.rfc2217 else line)
+        except socket.error:
+            self.disconnected()
+
+    def flush(self):
+        if self.socket is None:
+            return
+        try:
+            if self.rfc2217:
+                self.subnegotiate(PURGE_DATA + PURGE_BOTH_BUFFERS)
+            while select.select([self.socket], [], [], 0)[0]:
+                if not self.socket.recv(4096):
+                    self.disconnected()
+        except (socket.error, select.error):
+            self.disconnected()
+        self.telnet = ''
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.socket is not None:
+            logger.info('disconnecting from %r' % self.filename)
+            self.socket.close()
+            self.socket = None
+
+
+class TCPPool(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, host, port, rfc2217=False):
+        with self.lock:
+            connections = self.idle.get((host, port, rfc2217))
+            io = connections.pop() if connections else None
+        if io is not None:
+            try:
+                io.flush()
+                return io
+            except DisconnectError:
+                pass
+        return TCPIO(host, port, rfc2217, self)
+
+    def release(self, io):
+        if io.socket is None:
+            return
+        with self.lock:
+            self.idle.setdefault(io.key, []).append(io)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for io in connections:
+                io.disconnect()
+
+
+pool = TCPPool()
+
+
+def open_tcp(device):
+    m = TCP_DEVICE_RE.match(device)
+    if m is None:
+        return None
+    return pool.get(m.group(2), int(m.group(3)), m.group(1) == 'rfc2217')
@@ -0,0 +1,121 @@
+#   timing.py  Split wall time into wire, decode, disk and progress phases
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+
+
+WIRE = 'wire'
+DECODE = 'decode'
+DISK = 'disk'
+PROGRESS = 'progress'
+OTHER = 'other'
+
+PHASES = (WIRE, DECODE, DISK, PROGRESS)
+
+
+class Phase(object):
+
+    __slots__ = ('timer', 'name')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.enter(self.name)
+
+    def __exit__(self, type, value, traceback):
+        self.timer.exit()
+
+
+class NullPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.totals = dict((phase, 0.0) for phase in PHASES)
+
+    def phase(self, name):
+        return Phase(self, name) if self.enabled else NULL_PHASE
+
+    def charge(self, frame, now):
+        with self.lock:
+            self.totals[frame[0]] += now - frame[1]
+        frame[1] = now
+
+    def enter(self, name):
+        # Phases nest, and time is only charged to the innermost one, so
+        # decoding time excludes the reads that it triggers
+        now = time.time()
+        stack = self.local.__dict__.setdefault('stack', [])
+        if stack:
+            self.charge(stack[-1], now)
+        stack.append([name, now])
+
+    def exit(self):
+        now = time.time()
+        stack = self.local.stack
+        self.charge(stack.pop(), now)
+        if stack:
+            stack[-1][1] = now
+
+    def _iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def iterate(self, name, iterable):
+        return self._iterate(name, iterable) if self.enabled else iterable
+
+    def summary(self):
+        wall = time.time() - self.start
+        with self.lock:
+            result = [(phase, self.totals[phase]) for phase in PHASES]
+        result.append((OTHER, max(wall - sum(seconds for phase, seconds in result), 0.0)))
+        return wall, result
+
+    def report(self, file, prefix=''):
+        wall, result = self.summary()
+        file.write('%s%.3fs wall time\n' % (prefix, wall))
+        for phase, seconds in result:
+            file.write('%s  %-8s %9.3fs %5.1f%%\n' % (prefix, phase, seconds, 100 * seconds / wall if wall else 0.0))
+
+
+timer = Timer()
@@ -0,0 +1,81 @@
+#   transport.py  Transport interface implemented by all I/O classes
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from contextlib import contextmanager
+import tty
+
+from errors import DisconnectError, NotAvailableError
+from metrics import CommandMetrics, registry
+
+
+DEFAULT_SPEED = tty.B57600
+
+BAUD_RATES = {
+    tty.B9600: 9600,
+    tty.B19200: 19200,
+    tty.B38400: 38400,
+    tty.B57600: 57600,
+    tty.B115200: 115200,
+    tty.B230400: 230400}
+
+SPEEDS = dict((baud_rate, speed) for speed, baud_rate in BAUD_RATES.items())
+
+
+class Transport(object):
+
+    filename = None
+    speed = DEFAULT_SPEED
+    speed_negotiable = False
+    _metrics = None
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            self._metrics = CommandMetrics(registry)
+        return self._metrics
+
+    def read(self, timeout=1, n=None):
+        raise NotImplementedError
+
+    def readn(self, n, timeout=1):
+        data = bytearray()
+        while len(data) < n:
+            data.extend(self.read(timeout, n - len(data)))
+        return str(data)
+
+    def write(self, line):
+        raise NotImplementedError
+
+    def set_speed(self, speed):
+        raise NotAvailableError
+
+    def reconnect(self):
+        raise DisconnectError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def batching(self, vmin=255, vtime=1):
+        yield
+
+    @contextmanager
+    def flow_control(self):
+        yield
@@ -0,0 +1,86 @@
+#   usb.py  USB identity of serial devices
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path
+
+
+SYS_CLASS_TTY = '/sys/class/tty'
+
+# Instruments with their own USB interface ignore the line speed, unlike
+# the UARTs behind USB serial adapters
+NATIVE_USB_DRIVERS = ('cdc_acm',)
+
+
+def read_attribute(path, name):
+    try:
+        with open(os.path.join(path, name)) as file:
+            return file.read().strip()
+    except IOError:
+        return None
+
+
+def usb_device(filename):
+    name = os.path.basename(os.path.realpath(filename))
+    path = os.path.join(SYS_CLASS_TTY, name, 'device')
+    if not os.path.exists(path):
+        return None
+    path = os.path.realpath(path)
+    while path != '/':
+        if os.path.exists(os.path.join(path, 'idVendor')):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def usb_driver(filename):
+    name = os.path.basename(os.path.realpath(filename))
+    path = os.path.join(SYS_CLASS_TTY, name, 'device', 'driver')
+    if not os.path.exists(path):
+        return None
+    return os.path.basename(os.path.realpath(path))
+
+
+def native_usb(filename):
+    return usb_driver(filename) in NATIVE_USB_DRIVERS
+
+
+def usb_identity(filename):
+    # Adapters with a USB serial number are identified by it wherever they
+    # are plugged in, others by the USB port that they are plugged into
+    path = usb_device(filename)
+    if path is None:
+        return None
+    vendor = read_attribute(path, 'idVendor')
+    product = read_attribute(path, 'idProduct')
+    serial = read_attribute(path, 'serial')
+    if serial:
+        return '%s:%s:%s' % (vendor, product, serial)
+    else:
+        return '%s:%s@%s' % (vendor, product, os.path.basename(path))
+
+
+def find_usb_identity(identity):
+    try:
+        names = sorted(os.listdir(SYS_CLASS_TTY))
+    except OSError:
+        return None
+    for name in names:
+        filename = os.path.join('/dev', name)
+        if os.path.exists(filename) and usb_identity(filename) == identity:
+            return filename
+    return None
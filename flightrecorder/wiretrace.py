@@ -0,0 +1,94 @@
+#   wiretrace.py  Ring buffer of recent transport events
+#   Copyright (C) 2011  Tom Payne <twpayne@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from contextlib import contextmanager
+from itertools import count
+import logging
+import os
+import os.path
+import time
+
+from errors import FlashError, NotFoundError, ProtocolError, TimeoutError
+
+
+logger = logging.getLogger(__name__)
+
+
+READ = 'R'
+WRITE = 'W'
+TIMEOUT = 'T'
+DISCONNECT = 'D'
+
+SIZE = 4096
+
+
+class TraceBuffer(object):
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        # Slots are preallocated and overwritten in place, and next() on a
+        # count is atomic, so recording needs neither allocation nor a lock
+        self.counter = count()
+        self.sequences = [-1] * self.size
+        self.times = [0.0] * self.size
+        self.types = [None] * self.size
+        self.filenames = [None] * self.size
+        self.data = [None] * self.size
+
+    def record(self, type, filename, data=''):
+        sequence = next(self.counter)
+        i = sequence % self.size
+        self.times[i] = time.time()
+        self.types[i] = type
+        self.filenames[i] = filename
+        self.data[i] = data
+        self.sequences[i] = sequence
+
+    def events(self):
+        slots = sorted((sequence, i) for i, sequence in enumerate(self.sequences) if sequence >= 0)
+        for sequence, i in slots:
+            yield self.times[i], self.types[i], self.filenames[i], self.data[i]
+
+    def dump(self, filename):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+            os.makedirs(os.path.dirname(os.path.abspath(filename)))
+        with open(filename, 'w') as file:
+            for t, type, device, data in self.events():
+                file.write('%.6f %s %s %r\n' % (t, type, device, data))
+
+
+ring = TraceBuffer()
+
+
+@contextmanager
+def dump_on_error(filename):
+    try:
+        yield
+    except NotFoundError:
+        # Nothing answered, so there is no conversation worth keeping
+        raise
+    except (FlashError, ProtocolError, TimeoutError):
+        if filename:
+            try:
+                ring.dump(filename)
+                logger.info('wire trace written to %r', filename)
+            except (IOError, OSError):
+                logger.warning('cannot write wire trace to %r', filename)
+        raise
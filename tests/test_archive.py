@@ -0,0 +1,129 @@
+import os
+import os.path
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.archive import ArchiveWriter, archive_format
+
+
+LINES = ['B%06d4600000N00600000EA0100001000\r\n' % i for i in xrange(20000)]
+
+DATE_TIME = (2011, 6, 1, 12, 30, 0)
+
+
+class FailingArchiveWriter(ArchiveWriter):
+
+    # Fails writing the first chunk, and holds the background thread until
+    # the test has seen the error, so that the rest of the entry is still
+    # queued behind it
+    def __init__(self, filename):
+        self.failed = threading.Event()
+        self.resume = threading.Event()
+        ArchiveWriter.__init__(self, filename)
+
+    def do_data(self, value):
+        if not self.failed.is_set():
+            raise IOError
+        ArchiveWriter.do_data(self, value)
+
+    def do_abort(self, value):
+        if self.entry is not None and not self.failed.is_set():
+            self.failed.set()
+            self.resume.wait()
+        ArchiveWriter.do_abort(self, value)
+
+
+class TestArchiveWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename):
+        filename = os.path.join(self.directory, filename)
+        writer = ArchiveWriter(filename, queue_size=2)
+        done = []
+        writer.add('1.IGC', DATE_TIME, iter(LINES), done.append)
+        writer.add('2.IGC', DATE_TIME, iter(LINES[:10]), done.append)
+        writer.close()
+        self.assertEqual(done, ['1.IGC', '2.IGC'])
+        return filename
+
+    def test_format(self):
+        self.assertEqual(archive_format('tracks.ZIP'), 'zip')
+        self.assertEqual(archive_format('tracks.tgz'), 'w:gz')
+        self.assertEqual(archive_format('tracks.tar.bz2'), 'w:bz2')
+        self.assertEqual(archive_format('tracks.igc'), None)
+
+    def test_zip(self):
+        zf = zipfile.ZipFile(self.write('tracks.zip'))
+        self.assertEqual(zf.namelist(), ['1.IGC', '2.IGC'])
+        zi = zf.getinfo('1.IGC')
+        self.assertEqual(zi.compress_type, zipfile.ZIP_DEFLATED)
+        self.assertTrue(zi.compress_size < zi.file_size)
+        self.assertEqual(zi.date_time, DATE_TIME)
+        self.assertEqual((zi.external_attr >> 16) & 0777, 0644)
+        self.assertEqual(zf.read('1.IGC'), ''.join(LINES))
+        self.assertEqual(zf.read('2.IGC'), ''.join(LINES[:10]))
+
+    def test_tar(self):
+        for filename in ('tracks.tar.gz', 'tracks.tar.bz2'):
+            tf = tarfile.open(self.write(filename))
+            self.assertEqual(tf.getnames(), ['1.IGC', '2.IGC'])
+            self.assertEqual(tf.getmember('1.IGC').mtime, 1306931400)
+            self.assertEqual(tf.extractfile('1.IGC').read(), ''.join(LINES))
+
+    def test_abort(self):
+        def lines():
+            for line in LINES:
+                yield line
+            raise IOError
+
+        filename = os.path.join(self.directory, 'tracks.zip')
+        writer = ArchiveWriter(filename)
+        writer.add('1.IGC', DATE_TIME, iter(LINES[:10]))
+        self.assertRaises(IOError, writer.add, '2.IGC', DATE_TIME, lines())
+        writer.close()
+        # The archive still holds the tracklogs downloaded before the error
+        self.assertEqual(zipfile.ZipFile(filename).namelist(), ['1.IGC'])
+        self.assertEqual(os.listdir(self.directory), ['tracks.zip'])
+
+    def test_write_error(self):
+        filename = os.path.join(self.directory, 'tracks.zip')
+        writer = FailingArchiveWriter(filename)
+
+        def lines():
+            for line in LINES:
+                yield line
+            writer.failed.wait()
+
+        done = []
+        self.assertRaises(IOError, writer.add, '1.IGC', DATE_TIME, lines(), done.append)
+        writer.resume.set()
+        writer.add('2.IGC', DATE_TIME, iter(LINES), done.append)
+        writer.add('3.IGC', DATE_TIME, iter(LINES[:10]), done.append)
+        writer.close()
+        # The rest of the failed entry is discarded, later entries are written
+        self.assertEqual(done, ['2.IGC', '3.IGC'])
+        self.assertEqual(zipfile.ZipFile(filename).namelist(), ['2.IGC', '3.IGC'])
+
+    def test_close_without_reraise(self):
+        filename = os.path.join(self.directory, 'tracks.zip')
+        writer = FailingArchiveWriter(filename)
+        writer.resume.set()
+        writer.add('1.IGC', DATE_TIME, iter(LINES[:10]))
+        writer.close(reraise=False)
+        self.assertEqual(zipfile.ZipFile(filename).namelist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
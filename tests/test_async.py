@@ -0,0 +1,93 @@
+import os
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder import FlightRecorder
+import flightrecorder.flightrecorder as flightrecorder
+from flightrecorder.emulator import Fifty20Emulator, FlymasterEmulator, Sixty15Emulator
+from flightrecorder.errors import DisconnectError
+from flightrecorder.flightrecorder import aprobe, aprobe_all
+from flightrecorder.reactor import Reactor
+from test_emulator import EmulatorFixture, EmulatorsFixture
+
+
+class AsyncTestMixin(EmulatorFixture):
+
+    def open(self, filename):
+        self.reactor = Reactor()
+        return self.reactor.run_until_complete(aprobe(self.reactor, filename))
+
+    def test_identify(self):
+        self.assertEqual(self.fr.__class__.__name__, self.DRIVER)
+
+    def test_igc_streams(self):
+        tracks = self.reactor.run_until_complete(self.fr.atracks())
+        lines = []
+        task = self.reactor.task(tracks[1].aigc(lambda line: lines.append((line, task.done))))
+        self.reactor.run_until_complete(task)
+        # Every line reaches the callback before the download has finished
+        self.assertFalse(any(done for line, done in lines))
+        self.fr.io.close()
+        fr = FlightRecorder(self.emulator.filename)
+        try:
+            self.assertEqual([line for line, done in lines], list(fr.tracks()[1].igc))
+        finally:
+            fr.io.close()
+
+    def test_unplugged(self):
+        self.emulator.close()
+        self.assertRaises(DisconnectError, self.reactor.run_until_complete, self.fr.atracks())
+
+    def test_sync_methods(self):
+        # Synchronous methods fail clearly instead of returning futures
+        self.assertRaises(RuntimeError, lambda: list(self.fr.waypoints()))
+
+
+class TestFifty20(AsyncTestMixin, unittest.TestCase):
+
+    EMULATOR = Fifty20Emulator
+    DRIVER = 'Fifty20'
+
+
+class TestFlymaster(AsyncTestMixin, unittest.TestCase):
+
+    EMULATOR = FlymasterEmulator
+    DRIVER = 'Flymaster'
+
+
+class TestSixty15(AsyncTestMixin, unittest.TestCase):
+
+    EMULATOR = Sixty15Emulator
+    DRIVER = 'Sixty15'
+
+
+class TestProbeAll(EmulatorsFixture, unittest.TestCase):
+
+    def test_failure(self):
+        reactor = Reactor()
+        failing = self.devices[1]
+        aidentify = flightrecorder.aidentify
+
+        def broken(io, model=None):
+            if io.filename == failing:
+                raise RuntimeError
+            return aidentify(io, model)
+
+        fds = self.open_fds()
+        flightrecorder.aidentify = broken
+        try:
+            frs = reactor.run_until_complete(aprobe_all(reactor, self.devices))
+        finally:
+            flightrecorder.aidentify = aidentify
+        # One failed probe neither loses the others nor leaks its port
+        self.assertEqual(list(fr.__class__.__name__ for fr in frs), ['Fifty20', 'Sixty15'])
+        self.assertEqual(self.open_fds(), fds + 2)
+        for fr in frs:
+            fr.io.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
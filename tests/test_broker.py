@@ -0,0 +1,91 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.broker import Broker, RemoteFlightRecorder, connect
+from flightrecorder.emulator import Fifty20Emulator
+from flightrecorder.errors import NotAvailableError
+from flightrecorder.wiretrace import WRITE, ring
+
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Fifty20Emulator(tracks=2, fixes=300, waypoints=3).start()
+        self.directory = tempfile.mkdtemp()
+        self.broker = Broker(os.path.join(self.directory, 'broker.sock'))
+        self.broker.listen()
+        thread = threading.Thread(target=self.broker.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.broker.close()
+        self.emulator.close()
+        shutil.rmtree(self.directory)
+
+    def remote(self):
+        return RemoteFlightRecorder(connect(self.broker.path), self.emulator.filename)
+
+    def writes(self, prefix):
+        return len([data for t, type, filename, data in ring.events() if type == WRITE and data.startswith(prefix)])
+
+    def test_session(self):
+        ring.clear()
+        fr = self.remote()
+        self.assertEqual(fr.manufacturer, 'Brauniger')
+        self.assertEqual(fr.serial_number, 1234)
+        self.assertEqual(fr.io.filename, self.emulator.filename)
+        tracks = fr.tracks()
+        self.assertEqual(len(tracks), 2)
+        igc = list(tracks[1].igc)
+        self.assertEqual(len([line for line in igc if line.startswith('B')]), 300)
+        self.assertEqual(len(fr.waypoints()), 3)
+        self.assertRaises(NotAvailableError, fr.get, 'no_such_parameter')
+        fr.io.close()
+        # A second command reuses the open device and the cached track
+        # list, but tracklogs are not kept in the broker
+        fr = self.remote()
+        self.assertEqual(fr.serial_number, 1234)
+        self.assertEqual(list(fr.tracks()[1].igc), igc)
+        fr.io.close()
+        self.assertEqual(self.writes('$PBRSNP,'), 1)
+        self.assertEqual(self.writes('$PBRTL,'), 1)
+        self.assertEqual(self.writes('$PBRTR,'), 2)
+        device = self.broker.devices.open(self.emulator.filename)
+        self.assertTrue(all(track._igc is None for track in device.fr.tracks()))
+
+    def test_abandoned_download(self):
+        fr = self.remote()
+        igc = fr.tracks()[0].igc
+        for i in xrange(5):
+            next(igc)
+        igc.close()
+        # The broker closes the device and detects it again
+        fr = self.remote()
+        self.assertEqual(len([line for line in fr.tracks()[0].igc if line.startswith('B')]), 300)
+        fr.io.close()
+
+    def test_drop_replaced(self):
+        devices = self.broker.devices
+        old = devices.open(self.emulator.filename)
+        devices.drop(self.emulator.filename)
+        new = devices.open(self.emulator.filename)
+        # A late failure on the old device leaves its replacement open
+        devices.drop(self.emulator.filename, old)
+        self.assertTrue(devices.open(self.emulator.filename) is new)
+        devices.drop(self.emulator.filename, new)
+        self.assertFalse(self.emulator.filename in devices.devices)
+
+    def test_already_running(self):
+        self.assertRaises(RuntimeError, Broker(self.broker.path).listen)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.capture import CaptureIO, CaptureSession, ReplayIO, open_replay
+from flightrecorder.errors import ProtocolError, TimeoutError
+from flightrecorder.fifty20 import Fifty20
+from flightrecorder.transport import Transport
+from flightrecorder.wiretrace import READ, WRITE, ring
+
+
+IGC = ['HFDTE010611\r\n'] + ['B10%02d%02d4600000N00600000EA0100001000\r\n' % divmod(s, 60) for s in xrange(60)]
+
+
+class ScriptedIO(Transport):
+
+    filename = 'scripted'
+
+    def __init__(self):
+        self.responses = []
+
+    def read(self, timeout=1, n=None):
+        if not self.responses:
+            raise TimeoutError
+        return self.responses.pop(0)
+
+    def write(self, line):
+        if line.startswith('$PBRSNP,'):
+            self.responses.append('\x13' + 'PBRSNP,COMPEO+,Pilot,1234,1.0'.encode('nmea_sentence') + '\x11')
+        elif line.startswith('$PBRTR,'):
+            response = '\x13' + ''.join(IGC) + '\x11'
+            self.responses.extend(response[i:i + 256] for i in xrange(0, len(response), 256))
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.frc')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def capture(self):
+        session = CaptureSession(self.filename)
+        fr = Fifty20(CaptureIO(ScriptedIO(), session))
+        self.assertEqual(fr.serial_number, 1234)
+        self.assertEqual(fr.pbrtr(1), IGC)
+        session.close()
+
+    def test_replay(self):
+        self.capture()
+        fr = Fifty20(ReplayIO(self.filename))
+        self.assertEqual(fr.serial_number, 1234)
+        self.assertEqual(fr.pbrtr(1), IGC)
+
+    def test_open_replay(self):
+        self.capture()
+        self.assertFalse(open_replay('replay://%s' % self.filename).realtime)
+        self.assertTrue(open_replay('replay://%s?realtime' % self.filename).realtime)
+        self.assertRaises(IOError, open_replay, 'replay://%s?realtime#/dev/ttyUSB9' % self.filename)
+
+    def test_trace(self):
+        self.capture()
+        ring.clear()
+        io = ReplayIO(self.filename)
+        fr = Fifty20(io)
+        self.assertEqual(fr.serial_number, 1234)
+        types = list(type for t, type, filename, data in ring.events() if filename == io.filename)
+        self.assertEqual(types[0], WRITE)
+        self.assertTrue(READ in types)
+
+    def test_diverged(self):
+        self.capture()
+        fr = Fifty20(ReplayIO(self.filename))
+        self.assertRaises(ProtocolError, fr.pbrtr, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
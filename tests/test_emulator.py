@@ -0,0 +1,134 @@
+import os
+import os.path
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder import FlightRecorder
+from flightrecorder.emulator import Fifty20Emulator, FlymasterEmulator, Sixty15Emulator
+from flightrecorder.flightrecorder import pbrsnp_complete, probe_all
+
+
+EMULATORS = (Fifty20Emulator, FlymasterEmulator, Sixty15Emulator)
+
+
+class EmulatorFixture(object):
+
+    def setUp(self):
+        self.emulator = self.EMULATOR(tracks=3, fixes=120, waypoints=5).start()
+        self.fr = self.open(self.emulator.filename)
+
+    def tearDown(self):
+        self.fr.io.close()
+        self.emulator.close()
+
+    def open(self, filename):
+        return FlightRecorder(filename)
+
+
+class EmulatorsFixture(object):
+
+    def setUp(self):
+        self.emulators = list(emulator(tracks=1, fixes=10, waypoints=1).start() for emulator in EMULATORS)
+        self.devices = list(emulator.filename for emulator in self.emulators)
+
+    def tearDown(self):
+        for emulator in self.emulators:
+            emulator.close()
+
+    def open_fds(self):
+        return len(os.listdir('/proc/self/fd'))
+
+
+class EmulatorTestMixin(EmulatorFixture):
+
+    def test_detect(self):
+        self.assertEqual(self.fr.__class__.__name__, self.DRIVER)
+        self.assertEqual(self.fr.serial_number, 1234)
+
+    def test_confirm(self):
+        detection = self.fr.detection
+        self.fr.forget_identity()
+        self.assertTrue(self.fr.confirm(detection))
+        self.fr.forget_identity()
+        self.assertFalse(self.fr.confirm(dict(detection, serial_number=4321)))
+
+    def test_tracks(self):
+        tracks = self.fr.tracks()
+        self.assertEqual(len(tracks), 3)
+        igc = list(tracks[1].igc)
+        self.assertEqual(len([line for line in igc if line.startswith('B')]), 120)
+
+    def test_igc_stream(self):
+        tracks = self.fr.tracks()
+        igc = list(tracks[2].igc_stream())
+        self.assertEqual(len([line for line in igc if line.startswith('B')]), 120)
+        self.assertTrue(tracks[2]._igc is None)
+        self.assertEqual(list(tracks[2].igc), igc)
+        self.assertEqual(list(tracks[2].igc_stream()), igc)
+
+    def test_waypoints(self):
+        self.assertEqual(len(list(self.fr.waypoints())), 5)
+
+
+class TestFifty20Emulator(EmulatorTestMixin, unittest.TestCase):
+
+    EMULATOR = Fifty20Emulator
+    DRIVER = 'Fifty20'
+
+
+class TestFlymasterEmulator(EmulatorTestMixin, unittest.TestCase):
+
+    EMULATOR = FlymasterEmulator
+    DRIVER = 'Flymaster'
+
+    def test_faults(self):
+        tracks = self.fr.tracks()
+        # Corrupted packets are NAKed and sent again
+        self.emulator.faults = 0.2
+        self.assertEqual(len([line for line in tracks[0].igc if line.startswith('B')]), 120)
+
+
+class TestSixty15Emulator(EmulatorTestMixin, unittest.TestCase):
+
+    EMULATOR = Sixty15Emulator
+    DRIVER = 'Sixty15'
+
+
+class TestProbe(EmulatorsFixture, unittest.TestCase):
+
+    def setUp(self):
+        EmulatorsFixture.setUp(self)
+        self.devices.append('/dev/nonexistent')
+
+    def test_complete(self):
+        self.assertFalse(pbrsnp_complete(''))
+        self.assertFalse(pbrsnp_complete('\x13$PBRSNP,'))
+        self.assertTrue(pbrsnp_complete('\x13$PBRSNP,*21\r\n\x11'))
+
+    def test_all(self):
+        frs = probe_all(self.devices)
+        try:
+            self.assertEqual(list(fr.io.filename for fr in frs), self.devices[:3])
+            self.assertEqual(list(fr.__class__.__name__ for fr in frs), ['Fifty20', 'Flymaster', 'Sixty15'])
+        finally:
+            for fr in frs:
+                fr.io.close()
+
+    def test_first(self):
+        fds = self.open_fds()
+        frs = probe_all(self.devices, first=True)
+        self.assertEqual(len(frs), 1)
+        self.assertTrue(frs[0].io.filename in self.devices)
+        # The ports that lost the race are closed in the background
+        deadline = time.time() + 5
+        while self.open_fds() != fds + 1 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.open_fds(), fds + 1)
+        frs[0].io.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
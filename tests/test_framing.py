@@ -0,0 +1,70 @@
+import os.path
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.framing import COMPACT_THRESHOLD, FrameBuffer
+
+
+class TestFrameBuffer(unittest.TestCase):
+
+    def test_readline(self):
+        fb = FrameBuffer()
+        fb.feed('abc')
+        self.assertEqual(fb.readline(), None)
+        fb.feed('\ndef\nghi')
+        self.assertEqual(fb.readline(), 'abc\n')
+        self.assertEqual(fb.readline(), 'def\n')
+        self.assertEqual(fb.readline(), None)
+        self.assertEqual(fb.getvalue(), 'ghi')
+
+    def test_readline_split_terminator(self):
+        fb = FrameBuffer()
+        fb.feed('abc\r')
+        self.assertEqual(fb.readline('\r\n'), None)
+        fb.feed('\n')
+        self.assertEqual(fb.readline('\r\n'), 'abc\r\n')
+
+    def test_readmarker(self):
+        fb = FrameBuffer('\x13$A\r\n\x11')
+        self.assertEqual(fb.readmarker('\x11\x13'), '\x13')
+        self.assertEqual(fb.readmarker('\x11\x13'), None)
+        self.assertEqual(fb.readline(), '$A\r\n')
+        self.assertEqual(fb.readmarker('\x11\x13'), '\x11')
+        self.assertEqual(len(fb), 0)
+
+    def test_readlines(self):
+        fb = FrameBuffer('$A\r\n$B\r\n$C')
+        self.assertEqual(fb.readlines('\n', '\x11'), (['$A\r\n', '$B\r\n'], False))
+        self.assertEqual(fb.readlines('\n', '\x11'), ([], False))
+        fb.feed('\r\n\x11\x13')
+        self.assertEqual(fb.readlines('\n', '\x11'), (['$C\r\n'], True))
+        self.assertEqual(fb.getvalue(), '\x13')
+
+    def test_readpacket(self):
+        fb = FrameBuffer('\xa1\xa1\x03ab')
+        self.assertEqual(fb.readpacket(2, 1), None)
+        fb.feed('cX\xa2')
+        self.assertEqual(fb.readpacket(2, 1), '\xa1\xa1\x03abcX')
+        self.assertEqual(fb.readpacket(2, 1), None)
+        self.assertEqual(fb.getvalue(), '\xa2')
+
+    def test_match(self):
+        fb = FrameBuffer('S003Done16S004')
+        self.assertEqual(fb.match(re.compile(r'S003Done16')).group(), 'S003Done16')
+        self.assertEqual(fb.match(re.compile(r'S003Done16')), None)
+        self.assertEqual(fb.getvalue(), 'S004')
+
+    def test_compact(self):
+        fb = FrameBuffer()
+        line = 'x' * 99 + '\n'
+        for i in xrange(10 * COMPACT_THRESHOLD // len(line)):
+            fb.feed(line)
+            self.assertEqual(fb.readline(), line)
+        self.assertTrue(len(fb.data) <= 2 * COMPACT_THRESHOLD)
+
+
+if __name__ == '__main__':
+    unittest.main()
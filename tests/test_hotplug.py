@@ -0,0 +1,100 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import flightrecorder.hotplug as hotplug
+from flightrecorder.hotplug import HotplugWatcher, WorkerPool
+
+
+class TestHotplugWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.watcher = HotplugWatcher([os.path.join(self.directory, 'ttyUSB*')])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def touch(self, name):
+        filename = os.path.join(self.directory, name)
+        open(filename, 'w').close()
+        return filename
+
+    def watch(self):
+        first = self.touch('ttyUSB0')
+        devices = iter(self.watcher)
+        self.assertEqual(next(devices), first)
+        self.touch('ttyS0')
+        added = self.touch('ttyUSB1')
+        self.assertEqual(next(devices), added)
+        return devices
+
+    def test_inotify(self):
+        devices = self.watch()
+        # A device that is unplugged and plugged in again is reported again
+        os.remove(os.path.join(self.directory, 'ttyUSB1'))
+        added = self.touch('ttyUSB1')
+        self.assertEqual(next(devices), added)
+
+    def test_polling(self):
+        def unavailable(directories):
+            raise OSError
+
+        inotify, poll_interval = hotplug.Inotify, hotplug.POLL_INTERVAL
+        hotplug.Inotify, hotplug.POLL_INTERVAL = unavailable, 0.01
+        try:
+            self.watch()
+        finally:
+            hotplug.Inotify, hotplug.POLL_INTERVAL = inotify, poll_interval
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_concurrent(self):
+        started, release = threading.Semaphore(0), threading.Event()
+        handled = []
+
+        def handler(item):
+            handled.append(item)
+            started.release()
+            release.wait()
+
+        pool = WorkerPool(handler, workers=2)
+        pool.submit('a')
+        pool.submit('b')
+        # Both are handled at once, and an item that is already being
+        # handled is not queued again
+        started.acquire()
+        started.acquire()
+        pool.submit('a')
+        pool.submit('c')
+        release.set()
+        started.acquire()
+        self.assertEqual(sorted(handled), ['a', 'b', 'c'])
+
+    def test_failure(self):
+        done = threading.Semaphore(0)
+        handled = []
+
+        def handler(item):
+            handled.append(item)
+            done.release()
+            raise RuntimeError
+
+        # A failed item does not stop the only worker
+        pool = WorkerPool(handler, workers=1)
+        pool.submit('a')
+        pool.submit('b')
+        done.acquire()
+        done.acquire()
+        self.assertEqual(handled, ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
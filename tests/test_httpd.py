@@ -0,0 +1,135 @@
+import json
+import os
+import os.path
+import sys
+import threading
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.emulator import Fifty20Emulator
+from flightrecorder.httpd import FlightRecorderHTTPServer
+from flightrecorder.wiretrace import WRITE, ring
+
+
+class TestHTTPServer(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Fifty20Emulator(tracks=2, fixes=300, waypoints=3).start()
+        self.server = FlightRecorderHTTPServer(('localhost', 0), lambda: [self.emulator.filename])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.emulator.close()
+
+    def get(self, path, data=None):
+        return urllib2.urlopen('http://localhost:%d%s' % (self.server.server_address[1], path), data)
+
+    def error(self, path, data=None):
+        try:
+            self.get(path, data)
+        except urllib2.HTTPError, e:
+            return e
+        self.fail(path)
+
+    def get_json(self, path):
+        return json.load(self.get(path))
+
+    def test_devices(self):
+        devices = self.get_json('/devices')
+        self.assertEqual(len(devices), 1)
+        self.assertEqual(devices[0]['manufacturer'], 'Brauniger')
+        self.assertEqual(devices[0]['serial_number'], 1234)
+        self.assertEqual(devices[0]['tracks'], '/devices/1234/tracks')
+
+    def test_tracks(self):
+        ring.clear()
+        tracks = self.get_json('/devices/1234/tracks')
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual(tracks[1]['url'], '/devices/1234/tracks/2.igc')
+        response = self.get(tracks[1]['url'])
+        self.assertEqual(response.info()['Content-Type'], 'application/vnd.fai.igc')
+        self.assertEqual(response.info()['Transfer-Encoding'], 'chunked')
+        self.assertTrue(tracks[1]['igc_filename'] in response.info()['Content-Disposition'])
+        igc = response.read().splitlines()
+        self.assertEqual(len([line for line in igc if line.startswith('B')]), 300)
+        # The device stays open and its track list is reused
+        self.assertEqual(len(self.get_json('/devices/1234/tracks')), 2)
+        self.assertEqual(len([data for t, type, filename, data in ring.events() if type == WRITE and data.startswith('$PBRTL,')]), 1)
+
+    def test_waypoints(self):
+        waypoints = self.get('/devices/1234/waypoints?format=formatgeo').read().splitlines()
+        self.assertEqual(waypoints[0], '$FormatGEO')
+        self.assertEqual(len(waypoints), 4)
+
+    def test_post_waypoints(self):
+        ring.clear()
+        result = json.load(self.get('/devices/1234/waypoints', '$FormatGEO\nT01       N 46 00 00.00    E 006 00 00.00  1000  Test\n'))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['name'], 'Test')
+        self.assertEqual(len([data for t, type, filename, data in ring.events() if type == WRITE and data.startswith('$PBRWPR,')]), 1)
+
+    def test_post_ctrs(self):
+        openair = 'AC R\nAN Test\nAL GND\nAH 2000m\nDP 46:00:00 N 006:00:00 E\nDP 46:10:00 N 006:10:00 E\n'
+        self.assertEqual(json.load(self.get('/devices/1234/ctrs', openair)), ['Test'])
+
+    def test_internal_error(self):
+        device = self.server.open_all()[0]
+
+        def ctr_upload(ctr, warning_distance):
+            raise UnicodeError
+
+        device.fr.ctr_upload = ctr_upload
+        self.assertEqual(self.error('/devices/1234/ctrs', 'AC R\nAN Test\nDP 46:00:00 N 006:00:00 E\n').code, 500)
+        # The device is detected again for the next request
+        self.assertTrue(self.server.devices.find('1234') is None)
+        self.assertEqual(len(self.get_json('/devices/1234/tracks')), 2)
+
+    def test_concurrent(self):
+        ring.clear()
+        results = []
+
+        def client():
+            igc = self.get('/devices/1234/tracks/1.igc').read().splitlines()
+            results.append(len([line for line in igc if line.startswith('B')]))
+
+        threads = list(threading.Thread(target=client) for i in xrange(4))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [300] * 4)
+        # The flight recorder was detected once and shared by all clients
+        self.assertEqual(len([data for t, type, filename, data in ring.events() if type == WRITE and data.startswith('$PBRSNP,')]), 1)
+
+    def test_not_found(self):
+        for path in ('/', '/devices/9999/tracks', '/devices/1234/tracks/3.igc', '/devices/1234/waypoints?format=gpx'):
+            self.assertEqual(self.error(path).code, 400 if 'format' in path else 404)
+
+    def test_method_not_allowed(self):
+        e = self.error('/devices', '')
+        self.assertEqual(e.code, 405)
+        self.assertEqual(e.info()['Allow'], 'GET')
+        self.assertEqual(self.error('/devices/1234/ctrs').code, 405)
+
+    def test_invalid_openair(self):
+        self.assertEqual(self.error('/devices/1234/ctrs', 'AC R\nAN Test\nDP 46:00:00 N\n').code, 400)
+        self.assertEqual(self.error('/devices/1234/ctrs', 'AN Test\n').code, 400)
+
+    def test_probe_interval(self):
+        self.server.filenames = lambda: [self.emulator.filename, '/dev/null']
+        self.assertEqual(len(self.get_json('/devices')), 1)
+        probed = self.server.devices.probed['/dev/null']
+        self.assertFalse(self.emulator.filename in self.server.devices.probed)
+        # The port with nothing on it is not probed again straight away
+        self.assertEqual(len(self.get_json('/devices')), 1)
+        self.assertEqual(self.server.devices.probed['/dev/null'], probed)
+
+
+if __name__ == '__main__':
+    unittest.main()
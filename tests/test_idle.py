@@ -0,0 +1,90 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.emulator import FlymasterEmulator
+from flightrecorder.flightrecorder import aprobe
+import flightrecorder.idle as idle
+from flightrecorder.idle import INITIAL, MINIMUM, IdleListing, IdleTimeout
+from flightrecorder.reactor import Reactor
+
+
+class TestIdleTimeout(unittest.TestCase):
+
+    def test_floor(self):
+        self.assertEqual(IdleTimeout().timeout, INITIAL)
+        self.assertEqual(IdleTimeout(0.001).timeout, MINIMUM)
+
+    def test_decay(self):
+        it = IdleTimeout(0.2)
+        # One quick listing only lowers the learned gap a little
+        it.update(0.01)
+        self.assertTrue(it.gap > 0.19)
+        it.update(0.25)
+        self.assertEqual(it.gap, 0.25)
+
+    def test_listing(self):
+        it = IdleTimeout()
+        listing = IdleListing(it, 2)
+        self.assertEqual(listing.timeout(), 2)
+        listing.received()
+        self.assertEqual(listing.timeout(), INITIAL)
+        listing.received()
+        listing.finished()
+        self.assertTrue(it.gap is not None)
+
+
+class TestAsyncIdleListing(unittest.TestCase):
+
+    def setUp(self):
+        idle._idle_timeouts.clear()
+        self.emulator = FlymasterEmulator(tracks=1, fixes=10, waypoints=5).start()
+
+    def tearDown(self):
+        self.emulator.close()
+        idle._idle_timeouts.clear()
+
+    def test_waypoints(self):
+        reactor = Reactor()
+        fr = reactor.run_until_complete(aprobe(reactor, self.emulator.filename))
+        try:
+            waypoints = reactor.run_until_complete(fr.apfmwpl())
+            self.assertEqual(len(waypoints), 5)
+            # The same idle timeout is learned as by the synchronous listing
+            self.assertEqual(len(idle._idle_timeouts), 1)
+        finally:
+            fr.io.close()
+
+
+class TestSave(unittest.TestCase):
+
+    def setUp(self):
+        idle._idle_timeouts.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        idle._idle_timeouts.clear()
+
+    def test_save_concurrently(self):
+        filename = os.path.join(self.directory, 'idle.json')
+        idle.idle_timeout('B1NAV', '1.0', 'PFMWPL').update(0.1)
+        threads = list(threading.Thread(target=idle.save, args=(filename,)) for i in xrange(8))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(os.listdir(self.directory), ['idle.json'])
+        idle._idle_timeouts.clear()
+        idle.load(filename)
+        self.assertEqual(idle.idle_timeout('B1NAV', '1.0', 'PFMWPL').gap, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import datetime
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.common import Track
+from flightrecorder.ledger import Ledger, archive_location, track_key
+from flightrecorder.utc import UTC
+
+
+LINES = ['AXFL1234\r\n', 'HFDTE010611\r\n', 'B1000005506449N09251815EA0168201682\r\n']
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'flightrecorder', 'downloads.json')
+        self.track = Track(datetime=datetime.datetime(2011, 6, 1, 10, 0, 0, tzinfo=UTC()), duration=datetime.timedelta(hours=1, seconds=5))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def download(self, ledger, location, lines=LINES):
+        download = ledger.download('Flytec', 1234, self.track)
+        self.assertEqual(list(download.lines(iter(lines))), lines)
+        download.done(location)
+
+    def test_key(self):
+        self.assertEqual(track_key('Flytec', 1234, self.track), 'Flytec/1234/2011-06-01T10:00:00/3605')
+
+    def test_persistence(self):
+        ledger = Ledger(self.filename)
+        self.assertFalse(ledger.known('Flytec', 1234, self.track))
+        self.download(ledger, '/a/1.IGC')
+        self.download(ledger, archive_location('/b/tracks.zip', '1.IGC'))
+        self.download(ledger, '/a/1.IGC')
+        ledger = Ledger(self.filename)
+        self.assertTrue(ledger.known('Flytec', 1234, self.track))
+        self.assertFalse(ledger.known('Flytec', 1235, self.track))
+        entry = ledger.get(track_key('Flytec', 1234, self.track))
+        self.assertEqual(entry['size'], len(''.join(LINES)))
+        self.assertEqual(entry['locations'], ['/a/1.IGC', '/b/tracks.zip#1.IGC'])
+
+    def test_changed(self):
+        ledger = Ledger(self.filename)
+        self.download(ledger, '/a/1.IGC')
+        sha1 = ledger.get(track_key('Flytec', 1234, self.track))['sha1']
+        # A different tracklog under the same key replaces the old locations
+        self.download(ledger, '/b/1.IGC', LINES[:2])
+        entry = ledger.get(track_key('Flytec', 1234, self.track))
+        self.assertNotEqual(entry['sha1'], sha1)
+        self.assertEqual(entry['locations'], ['/b/1.IGC'])
+
+    def test_corrupt(self):
+        ledger = Ledger(self.filename)
+        self.download(ledger, '/a/1.IGC')
+        with open(self.filename) as file:
+            data = file.read()
+        with open(self.filename, 'w') as file:
+            file.write(data[:len(data) / 2])
+        # The damaged history is kept aside rather than overwritten
+        ledger = Ledger(self.filename)
+        self.assertFalse(ledger.known('Flytec', 1234, self.track))
+        names = os.listdir(os.path.dirname(self.filename))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].startswith('downloads.json.corrupt-'))
+        self.download(ledger, '/a/1.IGC')
+        self.assertEqual(len(os.listdir(os.path.dirname(self.filename))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
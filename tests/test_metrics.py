@@ -0,0 +1,117 @@
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder import FlightRecorder
+from flightrecorder.emulator import Fifty20Emulator, FlymasterEmulator
+from flightrecorder.metrics import Registry, command_name, registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_command_name(self):
+        self.assertEqual(command_name('$PBRTR,03*4D\r\n'), 'PBRTR')
+        self.assertEqual(command_name('$PFMDNL,LST,*56\r\n'), 'PFMDNL')
+        self.assertEqual(command_name('ACT_21_03\r\n'), 'ACT_21')
+        self.assertEqual(command_name('RPA_00\r\n'), 'RPA')
+        self.assertEqual(command_name('\xb1'), None)
+
+    def test_prometheus(self):
+        r = Registry()
+        r.inc('flightrecorder_lines_total', 3, command='PBRTR')
+        r.inc('flightrecorder_lines_total', command='PBRTR')
+        r.observe('flightrecorder_command_latency_seconds', 0.02, command='PBRTR')
+        r.observe('flightrecorder_command_latency_seconds', 20, command='PBRTR')
+        lines = r.prometheus().splitlines()
+        self.assertTrue('# TYPE flightrecorder_lines_total counter' in lines)
+        self.assertTrue('flightrecorder_lines_total{command="PBRTR"} 4' in lines)
+        self.assertTrue('flightrecorder_command_latency_seconds_bucket{command="PBRTR",le="0.01"} 0' in lines)
+        self.assertTrue('flightrecorder_command_latency_seconds_bucket{command="PBRTR",le="0.025"} 1' in lines)
+        self.assertTrue('flightrecorder_command_latency_seconds_bucket{command="PBRTR",le="+Inf"} 2' in lines)
+        self.assertTrue('flightrecorder_command_latency_seconds_count{command="PBRTR"} 2' in lines)
+
+    def test_save_json(self):
+        r = Registry()
+        r.inc('flightrecorder_timeouts_total', command='PFMDNL')
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'metrics.json')
+            r.save(filename)
+            with open(filename) as file:
+                snapshot = json.load(file)
+            self.assertEqual(snapshot['flightrecorder_timeouts_total']['values'], [dict(labels=dict(command='PFMDNL'), value=1)])
+            self.assertEqual(os.listdir(directory), ['metrics.json'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_save_concurrently(self):
+        r = Registry()
+        r.inc('flightrecorder_timeouts_total', command='PFMDNL')
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'metrics.prom')
+            threads = list(threading.Thread(target=r.save, args=(filename,)) for i in xrange(8))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(os.listdir(directory), ['metrics.prom'])
+            with open(filename) as file:
+                self.assertEqual(file.read(), r.prometheus())
+            # A missing directory is only a warning
+            r.save(os.path.join(directory, 'missing', 'metrics.prom'))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestDriverMetrics(unittest.TestCase):
+
+    def setUp(self):
+        registry.clear()
+
+    def value(self, name, command):
+        for value in registry.snapshot().get(name, {}).get('values', []):
+            if value['labels'] == dict(command=command):
+                return value.get('value', value.get('count'))
+        return 0
+
+    def test_fifty20(self):
+        emulator = Fifty20Emulator(tracks=1, fixes=60).start()
+        try:
+            fr = FlightRecorder(emulator.filename)
+            try:
+                list(fr.tracks()[0].igc)
+            finally:
+                fr.io.close()
+        finally:
+            emulator.close()
+        self.assertEqual(self.value('flightrecorder_command_latency_seconds', 'PBRTR'), 1)
+        self.assertTrue(self.value('flightrecorder_lines_total', 'PBRTR') >= 60)
+        self.assertTrue(self.value('flightrecorder_bytes_read_total', 'PBRTR') > 0)
+
+    def test_flymaster_naks(self):
+        emulator = FlymasterEmulator(tracks=1, fixes=300).start()
+        try:
+            fr = FlightRecorder(emulator.filename)
+            try:
+                tracks = fr.tracks()
+                emulator.faults = 0.3
+                list(tracks[0].igc)
+            finally:
+                fr.io.close()
+        finally:
+            emulator.close()
+        self.assertTrue(self.value('flightrecorder_packets_total', 'PFMDNL') > 0)
+        self.assertTrue(self.value('flightrecorder_naks_total', 'PFMDNL') > 0)
+        self.assertEqual(self.value('flightrecorder_naks_total', 'PFMDNL'), self.value('flightrecorder_checksum_errors_total', 'PFMDNL'))
+
+
+if __name__ == '__main__':
+    unittest.main()
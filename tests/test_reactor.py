@@ -0,0 +1,84 @@
+import os
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.errors import DisconnectError, TimeoutError
+from flightrecorder.reactor import Future, Reactor, Return
+from flightrecorder.serialio import AsyncSerialIO
+
+
+class TestReactor(unittest.TestCase):
+
+    def test_return(self):
+        def double(x):
+            raise Return(2 * x)
+            yield
+        reactor = Reactor()
+        self.assertEqual(reactor.run_until_complete(double(21)), 42)
+
+    def test_nested(self):
+        def inner(x):
+            future = Future()
+            reactor.call_later(0.01, lambda: future.set_result(x + 1))
+            value = yield future
+            raise Return(value)
+
+        def outer():
+            a = yield inner(1)
+            b = yield inner(a)
+            raise Return((a, b))
+        reactor = Reactor()
+        self.assertEqual(reactor.run_until_complete(outer()), (2, 3))
+
+    def test_exception(self):
+        def fail():
+            raise ValueError
+            yield
+        reactor = Reactor()
+        self.assertRaises(ValueError, lambda: reactor.run_until_complete(fail()))
+
+    def test_gather(self):
+        def value(x):
+            raise Return(x)
+            yield
+        reactor = Reactor()
+        self.assertEqual(reactor.run_until_complete(reactor.gather(value(1), value(2), value(3))), [1, 2, 3])
+
+
+class TestAsyncSerialIO(unittest.TestCase):
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.reactor = Reactor()
+        self.io = AsyncSerialIO(self.reactor, os.ttyname(slave))
+        os.close(slave)
+
+    def tearDown(self):
+        self.io.close()
+        os.close(self.master)
+
+    def test_read(self):
+        os.write(self.master, 'hello')
+        self.assertEqual(self.reactor.run_until_complete(self.io.areadn(5)), 'hello')
+
+    def test_timeout(self):
+        self.assertRaises(TimeoutError, lambda: self.reactor.run_until_complete(self.io.aread(0.01)))
+
+    def test_end_of_file(self):
+        # An unplugged USB serial adapter reads as end of file
+        os.close(self.io.fd)
+        self.io.fd, fd = os.pipe()
+        os.close(fd)
+        self.assertRaises(DisconnectError, lambda: self.reactor.run_until_complete(self.io.aread()))
+        self.assertTrue(self.io.fd is None)
+
+    def test_sync_read(self):
+        self.assertRaises(RuntimeError, self.io.read)
+        self.assertRaises(RuntimeError, self.io.readn, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import os.path
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# Modules that only some commands need, and that must not be imported
+# just to start the command line tool
+LAZY_MODULES = '''
+    flightrecorder.archive flightrecorder.broker flightrecorder.fifty20
+    flightrecorder.firmware flightrecorder.flymaster flightrecorder.hotplug
+    flightrecorder.httpd flightrecorder.nmea flightrecorder.sixty15
+    flightrecorder.tcpio flightrecorder.waypoint
+    BaseHTTPServer ConfigParser cProfile ctypes json socket tarfile zipfile
+'''.split()
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        source = '\n'.join((
+            'import imp, sys',
+            'sys.dont_write_bytecode = True',
+            'sys.path.insert(0, %r)' % ROOT,
+            'imp.load_source("flightrecorder_script", %r)' % os.path.join(ROOT, 'scripts', 'flightrecorder'),
+            'print " ".join(name for name, module in sys.modules.items() if module is not None)'))
+        modules = set(subprocess.Popen([sys.executable, '-c', source], stdout=subprocess.PIPE).communicate()[0].split())
+        self.assertTrue('flightrecorder.flightrecorder' in modules)
+        self.assertEqual(sorted(modules.intersection(LAZY_MODULES)), [])
+
+    def test_drivers(self):
+        from flightrecorder.drivers import DRIVERS, driver_class, model_driver_class
+        for name, module, models in DRIVERS:
+            self.assertEqual(driver_class(name).__name__, name)
+            self.assertEqual(driver_class(name).SUPPORTED_MODELS, models)
+            for model in models:
+                self.assertTrue(model_driver_class(model) is driver_class(name))
+        self.assertEqual(driver_class('Unknown'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import os.path
+import socket
+import sys
+import threading
+import tty
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.errors import NotAvailableError, TimeoutError
+from flightrecorder.fifty20 import Fifty20
+from flightrecorder.tcpio import TCPIO, TCPPool
+
+
+IGC = ['HFDTE010611\r\n'] + ['B10%02d%02d4600000N00600000EA0100001000\r\n' % divmod(s, 60) for s in xrange(300)]
+
+
+class Server(object):
+
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(4)
+        self.port = self.socket.getsockname()[1]
+        self.connections = []
+        self.accepted = threading.Semaphore(0)
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except socket.error:
+                return
+            self.connections.append(connection)
+            self.accepted.release()
+
+    def connection(self):
+        self.accepted.acquire()
+        return self.connections[-1]
+
+    def recv(self, connection, n):
+        data = ''
+        while len(data) < n:
+            data += connection.recv(n - len(data))
+        return data
+
+    def close(self):
+        self.socket.close()
+        for connection in self.connections:
+            connection.close()
+
+
+class Fifty20Server(Server):
+
+    # Answers PBRSNP and PBRTR, dropping the first connection half way
+    # through the tracklog
+    def accept(self):
+        dropped = False
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except socket.error:
+                return
+            self.connections.append(connection)
+            data = ''
+            while True:
+                chunk = connection.recv(1024)
+                if not chunk:
+                    break
+                data += chunk
+                while '\n' in data:
+                    line, data = data.split('\n', 1)
+                    if line.startswith('$PBRSNP,'):
+                        connection.sendall('\x13' + 'PBRSNP,COMPEO+,Pilot,1234,1.0'.encode('nmea_sentence') + '\x11')
+                    elif line.startswith('$PBRTR,'):
+                        response = '\x13' + ''.join(IGC) + '\x11'
+                        if not dropped:
+                            connection.sendall(response[:len(response) / 2])
+                            connection.close()
+                            dropped = True
+                            break
+                        connection.sendall(response)
+                else:
+                    continue
+                break
+
+
+class TestTCPIO(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_read_write(self):
+        io = TCPIO('127.0.0.1', self.server.port)
+        connection = self.server.connection()
+        io.write('$PBRSNP,*21\r\n')
+        self.assertEqual(self.server.recv(connection, 13), '$PBRSNP,*21\r\n')
+        connection.sendall('\xff\x11\x13')
+        self.assertEqual(io.readn(3), '\xff\x11\x13')
+        self.assertRaises(TimeoutError, io.read, 0.01)
+        self.assertRaises(NotAvailableError, io.set_speed, tty.B57600)
+        self.assertFalse(io.speed_negotiable)
+        io.close()
+
+    def test_rfc2217(self):
+        io = TCPIO('127.0.0.1', self.server.port, rfc2217=True)
+        connection = self.server.connection()
+        self.assertEqual(self.server.recv(connection, 13), '\xff\xfb\x2c\xff\xfa\x2c\x01\x00\x00\xe1\x00\xff\xf0')
+        io.set_speed(tty.B115200)
+        self.assertEqual(self.server.recv(connection, 10), '\xff\xfa\x2c\x01\x00\x01\xc2\x00\xff\xf0')
+        self.assertEqual(io.speed, tty.B115200)
+        self.assertTrue(io.speed_negotiable)
+        io.write('a\xffb')
+        self.assertEqual(self.server.recv(connection, 4), 'a\xff\xffb')
+        connection.sendall('\xff\xfd\x2c' + 'x\xff\xffy' + '\xff\xfa\x2c\x65\x00\xff\xf0' + 'z\xff')
+        self.assertEqual(io.readn(4), 'x\xffyz')
+        connection.sendall('\xfb\x01w')
+        self.assertEqual(io.read(), 'w')
+        io.close()
+
+    def test_pool(self):
+        pool = TCPPool()
+        io = pool.get('127.0.0.1', self.server.port)
+        self.server.connection()
+        io.close()
+        self.assertTrue(pool.get('127.0.0.1', self.server.port) is io)
+        io.close()
+        pool.close()
+        self.assertTrue(io.socket is None)
+        self.assertTrue(pool.get('127.0.0.1', self.server.port) is not io)
+
+
+class TestResync(unittest.TestCase):
+
+    def test_dropout(self):
+        server = Fifty20Server()
+        try:
+            fr = Fifty20(TCPIO('127.0.0.1', server.port))
+            self.assertEqual(fr.serial_number, 1234)
+            self.assertEqual(list(fr.resumable(lambda: fr.ipbrtr(1))()), IGC)
+            self.assertEqual(len(server.connections), 2)
+            fr.io.close()
+        finally:
+            server.close()
+
+    def test_negotiate_speed(self):
+        server = Fifty20Server()
+        try:
+            fr = Fifty20(TCPIO('127.0.0.1', server.port))
+            self.assertEqual(fr.negotiate_speed(), tty.B57600)
+            self.assertEqual(fr.detection['speed'], 57600)
+            fr.io.close()
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import os.path
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder.timing import DECODE, DISK, NULL_PHASE, OTHER, WIRE, Timer
+
+
+class TestTimer(unittest.TestCase):
+
+    def test_disabled(self):
+        timer = Timer()
+        self.assertTrue(timer.phase(WIRE) is NULL_PHASE)
+        iterable = [1, 2, 3]
+        self.assertTrue(timer.iterate(DECODE, iterable) is iterable)
+
+    def test_nested(self):
+        timer = Timer()
+        timer.enabled = True
+
+        def lines():
+            for i in xrange(2):
+                with timer.phase(WIRE):
+                    time.sleep(0.05)
+                yield i
+
+        for line in timer.iterate(DECODE, lines()):
+            with timer.phase(DISK):
+                time.sleep(0.02)
+        wall, result = timer.summary()
+        result = dict(result)
+        self.assertTrue(0.09 <= result[WIRE] < 0.15)
+        self.assertTrue(result[DECODE] < 0.05)
+        self.assertTrue(0.03 <= result[DISK] < 0.08)
+        self.assertAlmostEqual(sum(result.values()), wall, 2)
+        self.assertTrue(result[OTHER] >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flightrecorder import FlightRecorder
+from flightrecorder.emulator import Fifty20Emulator
+from flightrecorder.errors import NotAvailableError, NotFoundError, ProtocolError
+from flightrecorder.wiretrace import READ, WRITE, TraceBuffer, dump_on_error, ring
+
+
+class TestTraceBuffer(unittest.TestCase):
+
+    def test_wrap(self):
+        trace = TraceBuffer(4)
+        for i in xrange(10):
+            trace.record(WRITE, 'device', str(i))
+        self.assertEqual([data for t, type, filename, data in trace.events()], ['6', '7', '8', '9'])
+
+    def test_transport(self):
+        ring.clear()
+        emulator = Fifty20Emulator(tracks=1, fixes=10).start()
+        try:
+            fr = FlightRecorder(emulator.filename)
+            try:
+                list(fr.tracks()[0].igc)
+            finally:
+                fr.io.close()
+        finally:
+            emulator.close()
+        events = list(ring.events())
+        self.assertTrue(any(type == WRITE and data.startswith('$PBRTR,') for t, type, filename, data in events))
+        self.assertTrue(any(type == READ and filename == emulator.filename for t, type, filename, data in events))
+
+    def test_dump_on_error(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'trace', 'trace.txt')
+            ring.clear()
+            with dump_on_error(filename):
+                ring.record(WRITE, 'device', '$PBRSNP,*21\r\n')
+            self.assertFalse(os.path.exists(filename))
+            with self.assertRaises(NotAvailableError):
+                with dump_on_error(filename):
+                    raise NotAvailableError
+            self.assertFalse(os.path.exists(filename))
+            with self.assertRaises(NotFoundError):
+                with dump_on_error(filename):
+                    raise NotFoundError
+            self.assertFalse(os.path.exists(filename))
+            with self.assertRaises(ProtocolError):
+                with dump_on_error(filename):
+                    raise ProtocolError
+            with open(filename) as file:
+                self.assertTrue(file.read().endswith(" W device '$PBRSNP,*21\\r\\n'\n"))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()